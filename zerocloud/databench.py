@@ -0,0 +1,370 @@
+"""Data-scale benchmarks for the MapReduce and Snakebin search scripts.
+
+Generates synthetic corpora of different sizes, runs the MapReduce word
+frequency job (``mrmapper.py`` and ``mrreducer.py``) and a Snakebin search
+(``search_mapper.py`` and ``search_reducer.py``) over them with
+``localzc.py``, and writes the wall time, throughput, peak memory and output
+size of each group of each job to a JSON file::
+
+    $ python databench.py run --scale small --output before.json
+    ... change something ...
+    $ python databench.py run --scale small --output after.json
+    $ python databench.py compare before.json after.json
+
+Scales can also be given directly, as pairs of an object count and an object
+size, with ``--corpus 100000:1K --corpus 10:1G``. Words are drawn from a
+generated vocabulary, either uniformly or with a Zipf distribution (which is
+closer to natural language).
+"""
+import argparse
+import bisect
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+import localzc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEARCH_APP_DIR = os.path.join(HERE, 'snakebin', 'part4')
+
+DATA_CONTAINER = 'bench-data'
+# The search scripts expect to find the documents in this container:
+SEARCH_CONTAINER = 'snakebin-store'
+
+# (number of objects, object size) for each predefined scale:
+SCALES = {
+    'small': ['10:4K', '100:4K'],
+    'medium': ['1000:4K', '10:10M'],
+    'large': ['100000:1K', '10:1G'],
+    'huge': ['1000000:1K'],
+}
+
+DISTRIBUTIONS = ('uniform', 'zipf')
+ZIPF_EXPONENT = 1.0
+WORDS_PER_LINE = 12
+# The search term is the word with this rank in the vocabulary, which is
+# common, but not too common, with the Zipf distribution:
+SEARCH_TERM_RANK = 100
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(value):
+    """Parse a size like ``4K``, ``10M`` or ``1G`` (or plain bytes)."""
+    value = value.strip().upper()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(value[:-1]) * SIZE_SUFFIXES[value[-1]]
+    return int(value)
+
+
+def parse_corpus(value):
+    """Parse an ``OBJECTS:SIZE`` corpus specification."""
+    objects, _sep, size = value.partition(':')
+    try:
+        return int(objects), parse_size(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected OBJECTS:SIZE, like 100:4K: %r' % value)
+
+
+def make_vocabulary(size, seed=0):
+    """Return a list of ``size`` distinct made-up words, in random order."""
+    rand = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rand.choice(string.ascii_lowercase)
+                          for _ in range(rand.randint(2, 10))))
+    words = sorted(words)
+    rand.shuffle(words)
+    return words
+
+
+class WordSampler(object):
+    """Draw words at random from ``vocabulary``.
+
+    With the ``zipf`` distribution, the n-th word of the vocabulary is drawn
+    with a probability proportional to ``1 / n ** ZIPF_EXPONENT``.
+    """
+
+    def __init__(self, vocabulary, distribution, seed=0):
+        self.vocabulary = vocabulary
+        self.rand = random.Random(seed)
+        if distribution == 'zipf':
+            total = 0.0
+            self._cumulative = []
+            for rank in range(1, len(vocabulary) + 1):
+                total += 1.0 / rank ** ZIPF_EXPONENT
+                self._cumulative.append(total)
+        else:
+            self._cumulative = None
+
+    def sample(self, count):
+        vocabulary = self.vocabulary
+        random_ = self.rand.random
+        if self._cumulative is None:
+            size = len(vocabulary)
+            return [vocabulary[int(random_() * size)] for _ in range(count)]
+        cumulative = self._cumulative
+        total = cumulative[-1]
+        return [vocabulary[bisect.bisect(cumulative, random_() * total)]
+                for _ in range(count)]
+
+
+def write_object(path, size, sampler):
+    """Write about ``size`` bytes of lines of random words to ``path``."""
+    written = 0
+    with open(path, 'w') as fp:
+        while written < size:
+            words = sampler.sample(WORDS_PER_LINE * 100)
+            lines = [' '.join(words[i:i + WORDS_PER_LINE])
+                     for i in range(0, len(words), WORDS_PER_LINE)]
+            block = '\n'.join(lines) + '\n'
+            if written + len(block) > size:
+                block = block[:size - written]
+            fp.write(block)
+            written += len(block)
+
+
+def make_corpus(store_dir, num_objects, object_size, sampler):
+    """Fill the data container in ``store_dir`` with ``num_objects`` objects
+    of ``object_size`` bytes each.
+    """
+    data_dir = os.path.join(store_dir, DATA_CONTAINER)
+    os.makedirs(data_dir)
+    for i in range(num_objects):
+        # No extension, like the short names of Snakebin scripts, since the
+        # same objects are searched as `snakebin-store`.
+        write_object(os.path.join(data_dir, 'doc%07d' % i), object_size,
+                     sampler)
+    os.symlink(data_dir, os.path.join(store_dir, SEARCH_CONTAINER))
+
+
+def _exec(args, env=None):
+    return {'path': 'file://python2.7:python', 'args': args, 'env': env or {}}
+
+
+def _devices(*extra):
+    return [{'name': 'python2.7'}, {'name': 'stdout'}] + list(extra)
+
+
+def mapreduce_job(binary=False):
+    flags = ' --binary' if binary else ''
+    return [
+        {
+            'name': 'map',
+            'exec': _exec('mrmapper.py --words' + flags),
+            'devices': _devices({
+                'name': 'input',
+                'path': 'swift://~/%s/*' % DATA_CONTAINER,
+            }),
+            'connect': ['reduce'],
+        },
+        {
+            'name': 'reduce',
+            'exec': _exec('mrreducer.py --words --top 10' + flags),
+            'devices': _devices(),
+        },
+    ]
+
+
+def search_job(term):
+    env = {
+        'SNAKEBIN_SEARCH': json.dumps([term]),
+        'SNAKEBIN_SEARCH_OP': 'and',
+        'SNAKEBIN_SEARCH_REGEX': 'False',
+        'SNAKEBIN_SEARCH_ICASE': 'False',
+    }
+    return [
+        {
+            'name': 'search-mapper',
+            'exec': _exec('search_mapper.py', env),
+            'devices': _devices({
+                'name': 'input',
+                'path': 'swift://~/%s/*' % SEARCH_CONTAINER,
+            }),
+            'connect': ['search-reducer'],
+        },
+        {
+            'name': 'search-reducer',
+            'exec': _exec('search_reducer.py',
+                          {'SNAKEBIN_SEARCH_OFFSET': '0'}),
+            'devices': _devices(),
+        },
+    ]
+
+
+def summarize(result, job):
+    """Return a row of measurements for each group of ``job``, from the
+    ``localzc.Result`` of running it.
+    """
+    rows = []
+    for group in job:
+        nodes = [node for node in result.nodes
+                 if node.group['name'] == group['name']]
+        wall = (max(node.started + node.elapsed for node in nodes)
+                - min(node.started for node in nodes))
+        input_bytes = sum(node.input_bytes for node in nodes)
+        rows.append({
+            'group': group['name'],
+            'nodes': len(nodes),
+            'wall_seconds': round(wall, 4),
+            'node_seconds': round(sum(node.elapsed for node in nodes), 4),
+            'input_bytes': input_bytes,
+            'output_bytes': sum(node.output_bytes for node in nodes),
+            'mb_per_second': round(input_bytes / (1024.0 ** 2) / wall, 3),
+            'peak_rss_mb': round(max(node.max_rss for node in nodes) / 1024.0,
+                                 1),
+        })
+    return rows
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=HERE,
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    corpora = list(args.corpus)
+    for scale in args.scale:
+        corpora.extend(parse_corpus(corpus) for corpus in SCALES[scale])
+    if not corpora:
+        corpora = [parse_corpus(corpus) for corpus in SCALES['small']]
+
+    vocabulary = make_vocabulary(args.vocabulary, seed=args.seed)
+    term = vocabulary[min(SEARCH_TERM_RANK, len(vocabulary) - 1)]
+    benchmarks = {
+        'mapreduce': (HERE, mapreduce_job(binary=args.binary)),
+        'search': (SEARCH_APP_DIR, search_job(term)),
+    }
+
+    results = []
+    for num_objects, object_size in corpora:
+        for distribution in args.distribution:
+            store_dir = tempfile.mkdtemp(prefix='databench-')
+            try:
+                sampler = WordSampler(vocabulary, distribution,
+                                      seed=args.seed)
+                make_corpus(store_dir, num_objects, object_size, sampler)
+                for name in args.benchmarks:
+                    app_dir, job = benchmarks[name]
+                    cloud = localzc.LocalZeroCloud(
+                        store_dir, app_dir, python=args.python,
+                        processes=args.processes)
+                    result = cloud.execute(job)
+                    for row in summarize(result, job):
+                        row.update(benchmark=name, objects=num_objects,
+                                   object_size=object_size,
+                                   distribution=distribution)
+                        results.append(row)
+                        print >>sys.stderr, (
+                            '%(benchmark)-10s %(group)-15s %(objects)8d x '
+                            '%(object_size)-11d %(distribution)-8s '
+                            '%(wall_seconds)9.3fs %(mb_per_second)9.2f MB/s '
+                            '%(peak_rss_mb)8.1f MB' % row
+                        )
+            finally:
+                shutil.rmtree(store_dir)
+
+    report = {
+        'revision': _revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'python': args.python,
+        'processes': args.processes,
+        'vocabulary': args.vocabulary,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+
+def _key(row):
+    return (row['benchmark'], row['group'], row['objects'],
+            row['object_size'], row['distribution'])
+
+
+def compare(args):
+    """Compare two result files. Exits with status 1 if any wall time or peak
+    memory grew by more than the threshold.
+    """
+    with open(args.old) as fp:
+        old = dict((_key(row), row) for row in json.load(fp)['results'])
+    with open(args.new) as fp:
+        new = dict((_key(row), row) for row in json.load(fp)['results'])
+
+    regressions = 0
+    print '%-45s %12s %12s' % ('', 'wall', 'peak RSS')
+    for key in sorted(set(old) & set(new)):
+        ratios = []
+        for field in ('wall_seconds', 'peak_rss_mb'):
+            before = old[key][field]
+            ratio = new[key][field] / before if before else 1.0
+            if ratio > 1 + args.threshold:
+                regressions += 1
+            ratios.append(ratio)
+        print '%-45s %11.2fx %11.2fx' % (
+            '%s/%s %dx%d %s' % key, ratios[0], ratios[1])
+    for key in sorted(set(old) ^ set(new)):
+        print '%-45s only in %s' % ('%s/%s %dx%d %s' % key,
+                                    args.old if key in old else args.new)
+    if regressions:
+        sys.exit('%d measurements regressed by more than %d%%'
+                 % (regressions, args.threshold * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    run_parser = subparsers.add_parser(
+        'run', help='Run the benchmarks and write the results to a file')
+    run_parser.add_argument('--scale', nargs='+', default=[],
+                            choices=sorted(SCALES))
+    run_parser.add_argument('--corpus', type=parse_corpus, action='append',
+                            default=[], metavar='OBJECTS:SIZE',
+                            help='Number and size of generated objects')
+    run_parser.add_argument('--distribution', nargs='+',
+                            default=list(DISTRIBUTIONS),
+                            choices=DISTRIBUTIONS)
+    run_parser.add_argument('--vocabulary', type=int, default=50000,
+                            help='Number of distinct words')
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--benchmarks', nargs='+',
+                            default=['mapreduce', 'search'],
+                            choices=['mapreduce', 'search'])
+    run_parser.add_argument('--binary', action='store_true',
+                            help='Use binary records for MapReduce')
+    run_parser.add_argument('--python', default=sys.executable,
+                            help='Python interpreter to run the scripts with')
+    run_parser.add_argument('--processes', type=int,
+                            help='Number of nodes to run at the same time')
+    run_parser.add_argument('--output', default='databench.json')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='Compare two result files')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Allowed growth, as a fraction')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
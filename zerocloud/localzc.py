@@ -0,0 +1,604 @@
+"""Run ZeroCloud jobs locally.
+
+This is a rough stand-in for ZeroCloud, for testing and measuring
+applications on a development machine. It takes a job description (as
+produced by ``Job.to_json()`` in the Snakebin tutorial, or the ``execution``
+section of a ``zapp.yaml``) and runs each node of the job in its own Python
+process, with the devices of the node laid out as files in a scratch
+directory::
+
+    $ python localzc.py --store ./store --app snakebin/part4 \\
+          --env PATH_INFO=/local/snakebin-api/Wg4re8mXbV \\
+          snakebin/part4/zapp.yaml
+
+Swift paths (``swift://~/container/object``) refer to files in the
+``--store`` directory, which has one sub-directory per container. The
+programs being run still open ``/dev/input``, ``/dev/in/...`` and so on; the
+process running them redirects these paths to its scratch directory, and
+other absolute paths to the files of the application, as if they were in the
+root of a ZeroVM image.
+
+Some things work differently from ZeroCloud:
+
+* Connected nodes don't stream to each other. All of the nodes in a group run
+  (in parallel, up to ``--processes`` at a time) and finish before the nodes
+  they are connected to start.
+* ZeroCloud tells devices which are read from devices which are written to by
+  their names. Other devices are treated as written to if they have a
+  ``content_type``, as in the examples in this documentation.
+* There is no isolation: the programs run with the same permissions as this
+  script.
+"""
+import argparse
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+import shlex
+import shutil
+import sqlite3
+import StringIO
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+SWIFT_PREFIX = 'swift://~/'
+
+READ_DEVICES = ('stdin', 'input')
+WRITE_DEVICES = ('stdout', 'stderr', 'output')
+STREAM_DEVICES = ('stdout', 'stderr')
+# Devices for the Python interpreter and the application itself, which are
+# both taken from the local machine instead:
+IGNORED_DEVICES = ('python2.7', 'image')
+
+# Maximum number of jobs chained with ``X-Zerovm-Execute``, one after the
+# other, before we give up:
+MAX_CHAIN_LENGTH = 10
+
+# Environment of the top-level job, as if it was started by a request:
+DEFAULT_ENV = {
+    'REQUEST_METHOD': 'GET',
+    'SCRIPT_NAME': '',
+    'PATH_INFO': '/',
+    'QUERY_STRING': '',
+    'SERVER_NAME': 'localhost',
+    'SERVER_PORT': '80',
+    'SERVER_PROTOCOL': 'HTTP/1.0',
+    'HTTP_HOST': 'localhost',
+}
+
+
+class JobFailed(Exception):
+    """Raised when a job can't be run, or one of its nodes fails."""
+
+
+class LocalStore(object):
+    """Object storage in a local directory, with one sub-directory for each
+    container.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def parse(self, path):
+        """Split a ``swift://~/container/object`` path into the container and
+        object names. The object name is ``None`` for a container.
+        """
+        if not path.startswith(SWIFT_PREFIX):
+            raise JobFailed('Unsupported path: %s' % path)
+        parts = path[len(SWIFT_PREFIX):].split('/', 1)
+        if len(parts) == 1 or not parts[1]:
+            return parts[0], None
+        return parts[0], parts[1]
+
+    def object_path(self, container, obj):
+        return os.path.join(self.root, container, obj)
+
+    def list(self, container, pattern='*'):
+        """Return the sorted names of the objects in ``container`` which
+        match ``pattern``.
+        """
+        cont_dir = os.path.join(self.root, container)
+        if not os.path.isdir(cont_dir):
+            return []
+        return sorted(name for name in os.listdir(cont_dir)
+                      if fnmatch.fnmatch(name, pattern))
+
+    def write_container_db(self, container, db_path):
+        """Write the listing of ``container`` to a sqlite database, the way
+        ZeroCloud provides it to a device mapped to a container.
+        """
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute('CREATE TABLE object (name TEXT PRIMARY KEY, '
+                         'created_at TEXT, size INTEGER, content_type TEXT, '
+                         'etag TEXT, deleted INTEGER DEFAULT 0)')
+            for name in self.list(container):
+                path = self.object_path(container, name)
+                md5 = hashlib.md5()
+                with open(path) as fp:
+                    for chunk in iter(lambda: fp.read(1024 * 1024), ''):
+                        md5.update(chunk)
+                conn.execute(
+                    'INSERT INTO object VALUES (?, ?, ?, ?, ?, 0)',
+                    (name, str(os.path.getmtime(path)),
+                     os.path.getsize(path), 'application/octet-stream',
+                     md5.hexdigest())
+                )
+        conn.close()
+
+
+def load_job(path):
+    """Load a job description from a JSON file or a ``zapp.yaml``."""
+    with open(path) as fp:
+        data = fp.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise JobFailed('PyYAML is needed to read %s' % path)
+        return yaml.safe_load(data)['execution']['groups']
+    return json.loads(data)
+
+
+def _group(desc):
+    # Both job descriptions (with an `exec` section) and `zapp.yaml` groups
+    # (with `path` and `args` at the top level) are accepted.
+    exec_desc = desc.get('exec', desc)
+    return {
+        'name': desc['name'],
+        'args': exec_desc.get('args') or '',
+        'env': dict(exec_desc.get('env') or {}),
+        'devices': desc.get('devices', []),
+        'connect': desc.get('connect', []),
+        'count': desc.get('count'),
+    }
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _dir_size(path):
+    return sum(_size(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _is_written(device):
+    if device['name'] in WRITE_DEVICES:
+        return True
+    if device['name'] in READ_DEVICES:
+        return False
+    return 'content_type' in device
+
+
+class Node(object):
+    """One instance of a group, with the devices it will be given.
+
+    Once it has run, ``started`` holds the time it started at, ``elapsed``
+    its wall-clock time in seconds, ``max_rss`` its peak resident set size in
+    kilobytes, and ``input_bytes`` and ``output_bytes`` the amount of data it
+    was given and produced (on devices, channels and ``stdout``).
+    """
+
+    def __init__(self, group, name, devices, env):
+        self.group = group
+        self.name = name
+        self.devices = devices
+        self.env = env
+        self.sandbox = None
+        self.inputs = []
+        self.outputs = []
+        self.returncode = None
+        self.started = None
+        self.elapsed = None
+        self.max_rss = None
+        self.input_bytes = None
+        self.output_bytes = None
+
+
+def expand_group(group, store):
+    """Return the nodes for ``group``: one for each object matched by a
+    wildcard ``path``, ``count`` of them, or just one.
+    """
+    name = group['name']
+    for i, dev in enumerate(group['devices']):
+        if '*' in dev.get('path', ''):
+            container, pattern = store.parse(dev['path'])
+            objects = store.list(container, pattern)
+            if not objects:
+                raise JobFailed('No objects match %s' % dev['path'])
+            nodes = []
+            for j, obj in enumerate(objects):
+                devices = list(group['devices'])
+                devices[i] = dict(dev, path='%s%s/%s' % (SWIFT_PREFIX,
+                                                         container, obj))
+                nodes.append(Node(group, '%s-%d' % (name, j + 1), devices,
+                                  group['env']))
+            return nodes
+    if group['count'] is not None:
+        return [Node(group, '%s-%d' % (name, j + 1), group['devices'],
+                     group['env'])
+                for j in range(group['count'])]
+    return [Node(group, name, group['devices'], group['env'])]
+
+
+def _stages(groups):
+    # Order the groups so that each one comes after the groups connected to
+    # it. Groups in the same stage don't depend on each other.
+    names = set(group['name'] for group in groups)
+    sources = dict((group['name'], set()) for group in groups)
+    for group in groups:
+        for dest in group['connect']:
+            if dest not in names:
+                raise JobFailed('%s is connected to unknown group %r'
+                                % (group['name'], dest))
+            sources[dest].add(group['name'])
+    stages = []
+    done = set()
+    while len(done) < len(groups):
+        stage = [group for group in groups
+                 if group['name'] not in done
+                 and sources[group['name']] <= done]
+        if not stage:
+            raise JobFailed('The connections between groups form a cycle')
+        stages.append(stage)
+        done.update(group['name'] for group in stage)
+    return stages
+
+
+def _parse_http(data):
+    # Split an HTTP response into its status line, headers and body.
+    head, _sep, body = data.partition('\r\n\r\n')
+    lines = head.split('\r\n')
+    headers = {}
+    for line in lines[1:]:
+        key, _sep, value = line.partition(':')
+        headers[key.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding') == 'chunked':
+        body = _dechunk(body)
+    return lines[0], headers, body
+
+
+def _dechunk(body):
+    chunks = []
+    pos = 0
+    while True:
+        line_end = body.index('\r\n', pos)
+        size = int(body[pos:line_end].split(';')[0], 16)
+        if size == 0:
+            return ''.join(chunks)
+        start = line_end + 2
+        chunks.append(body[start:start + size])
+        pos = start + size + 2
+
+
+def _read_tar_job(data):
+    tar = tarfile.open(fileobj=StringIO.StringIO(data))
+    job = None
+    files = {}
+    for member in tar.getmembers():
+        contents = tar.extractfile(member).read()
+        if member.name == 'boot/system.map':
+            job = json.loads(contents)
+        else:
+            files[member.name] = contents
+    if job is None:
+        raise JobFailed('No boot/system.map in the chained job')
+    return job, files
+
+
+class Result(object):
+    """The outcome of running a job: its ``output`` (the ``stdout`` of the
+    final node), the number of jobs ``chained`` to it, the time each node and
+    each stage took, as ``(name, seconds)`` pairs in ``timings``, and the
+    ``Node`` objects which were run.
+    """
+
+    def __init__(self):
+        self.output = ''
+        self.chained = 0
+        self.timings = []
+        self.nodes = []
+        self.elapsed = None
+
+
+def _str_env(env):
+    # JSON gives us unicode, but the environment needs byte strings.
+    return dict((key.encode('utf-8') if isinstance(key, unicode) else key,
+                 val.encode('utf-8') if isinstance(val, unicode) else str(val))
+                for key, val in env.items())
+
+
+class LocalZeroCloud(object):
+
+    def __init__(self, store_dir, app_dir, python=sys.executable,
+                 processes=None, keep=False):
+        self.store = LocalStore(store_dir)
+        self.app_dir = os.path.abspath(app_dir)
+        self.python = python
+        self.processes = processes or multiprocessing.cpu_count()
+        self.keep = keep
+
+    def execute(self, job, env=None, stdin=''):
+        """Run ``job`` (a list of groups), with the request environment
+        ``env`` and request body ``stdin``. Jobs chained with
+        ``X-Zerovm-Execute`` are run as well.
+
+        Returns a ``Result``.
+        """
+        base_env = dict(DEFAULT_ENV)
+        base_env.update(env or {})
+        result = Result()
+        files = {'stdin': stdin}
+        start = time.time()
+        for _i in range(MAX_CHAIN_LENGTH):
+            output, http = self._execute_one(job, base_env, files, result)
+            result.output = output
+            result.elapsed = time.time() - start
+            if not http:
+                return result
+            _status, headers, body = _parse_http(output)
+            if 'x-zerovm-execute' not in headers:
+                return result
+            result.chained += 1
+            if headers.get('content-type') == 'application/x-tar':
+                job, files = _read_tar_job(body)
+            else:
+                job, files = json.loads(body), {}
+        raise JobFailed('More than %d chained jobs' % MAX_CHAIN_LENGTH)
+
+    def _execute_one(self, job, base_env, files, result):
+        groups = [_group(desc) for desc in job]
+        stages = _stages(groups)
+        nodes = dict((group['name'], expand_group(group, self.store))
+                     for group in groups)
+        workdir = tempfile.mkdtemp(prefix='localzc-')
+        try:
+            for group in groups:
+                for node in nodes[group['name']]:
+                    self._prepare(node, workdir, base_env, files, nodes)
+            pool = multiprocessing.pool.ThreadPool(self.processes)
+            try:
+                for i, stage in enumerate(stages):
+                    start = time.time()
+                    stage_nodes = [node for group in stage
+                                   for node in nodes[group['name']]]
+                    pool.map(self._run_node, stage_nodes)
+                    for node in stage_nodes:
+                        self._finish(node, nodes)
+                        result.timings.append((node.name, node.elapsed))
+                        result.nodes.append(node)
+                    stage_name = 'job %d stage %d' % (result.chained + 1,
+                                                      i + 1)
+                    result.timings.append((stage_name, time.time() - start))
+            finally:
+                pool.close()
+                pool.join()
+            # The output of the job comes from the nodes at the end of it.
+            final = [node for group in stages[-1]
+                     for node in nodes[group['name']]]
+            output = ''.join(self._read_stdout(node) for node in final)
+            http = len(final) == 1 and any(
+                dev['name'] == 'stdout'
+                and dev.get('content_type') == 'message/http'
+                for dev in final[0].devices
+            )
+            return output, http
+        finally:
+            if not self.keep:
+                shutil.rmtree(workdir)
+
+    def _prepare(self, node, workdir, base_env, files, nodes):
+        node.sandbox = os.path.join(workdir, node.name)
+        dev_dir = os.path.join(node.sandbox, 'dev')
+        os.makedirs(os.path.join(dev_dir, 'in'))
+        os.makedirs(os.path.join(dev_dir, 'out'))
+        env = dict(base_env)
+        for dev in node.devices:
+            if dev['name'] == 'input' and dev.get('path') is not None:
+                container, obj = self.store.parse(dev['path'])
+                if obj is not None:
+                    # The path of the object on `/dev/input`.
+                    env['LOCAL_PATH_INFO'] = '/local/%s/%s' % (container, obj)
+        env.update(node.env)
+        node.env = _str_env(env)
+
+        for dev in node.devices:
+            name = dev['name']
+            if name in IGNORED_DEVICES:
+                continue
+            local = os.path.join(dev_dir, name)
+            path = dev.get('path')
+            if name in STREAM_DEVICES:
+                # What the script writes to `sys.stdout` or `sys.stderr`, as
+                # well as to `/dev/stdout` or `/dev/stderr`, goes to the same
+                # file, which is uploaded if the device has a path.
+                local = os.path.join(node.sandbox, name)
+                os.symlink(local, os.path.join(dev_dir, name))
+            if _is_written(dev):
+                open(local, 'w').close()
+                if path is not None:
+                    node.outputs.append((local, path))
+            elif path is None:
+                with open(local, 'w') as fp:
+                    fp.write(files.get(name, ''))
+                node.inputs.append(name)
+            else:
+                node.inputs.append(name)
+                container, obj = self.store.parse(path)
+                if obj is None:
+                    self.store.write_container_db(container, local)
+                else:
+                    src = self.store.object_path(container, obj)
+                    if not os.path.exists(src):
+                        raise JobFailed('%s: object not found: %s'
+                                        % (node.name, path))
+                    shutil.copyfile(src, local)
+
+        for dest in node.group['connect']:
+            for dest_node in nodes[dest]:
+                open(os.path.join(dev_dir, 'out', dest_node.name),
+                     'w').close()
+
+    def _run_node(self, node):
+        args = shlex.split(node.group['args'])
+        if not args:
+            raise JobFailed('%s: nothing to run' % node.name)
+        env = dict(node.env)
+        for key in ('PATH', 'PYTHONPATH'):
+            if key in os.environ:
+                env.setdefault(key, os.environ[key])
+        cmd = ([self.python, os.path.abspath(__file__), '_child',
+                node.sandbox, self.app_dir] + args)
+        dev_dir = os.path.join(node.sandbox, 'dev')
+        stdin_path = os.path.join(dev_dir, 'stdin')
+        if not os.path.exists(stdin_path):
+            stdin_path = os.devnull
+        node.input_bytes = (
+            sum(_size(os.path.join(dev_dir, name)) for name in node.inputs)
+            + _dir_size(os.path.join(dev_dir, 'in'))
+        )
+        start = node.started = time.time()
+        with open(stdin_path) as stdin, \
+                open(os.path.join(node.sandbox, 'stdout'), 'a') as stdout, \
+                open(os.path.join(node.sandbox, 'stderr'), 'a') as stderr:
+            proc = subprocess.Popen(cmd, stdin=stdin, stdout=stdout,
+                                    stderr=stderr, env=env, cwd=self.app_dir)
+            _pid, status, rusage = os.wait4(proc.pid, 0)
+        node.elapsed = time.time() - start
+        if os.WIFEXITED(status):
+            node.returncode = os.WEXITSTATUS(status)
+        else:
+            node.returncode = -os.WTERMSIG(status)
+        # ru_maxrss is in kilobytes on Linux.
+        node.max_rss = rusage.ru_maxrss
+
+    def _finish(self, node, nodes):
+        if node.returncode != 0:
+            with open(os.path.join(node.sandbox, 'stderr')) as fp:
+                stderr = fp.read()
+            raise JobFailed('%s exited with status %d:\n%s'
+                            % (node.name, node.returncode, stderr))
+        stdout_path = os.path.join(node.sandbox, 'stdout')
+        node.output_bytes = (
+            _size(stdout_path)
+            + sum(_size(local) for local, _path in node.outputs
+                  if local != stdout_path)
+            + _dir_size(os.path.join(node.sandbox, 'dev', 'out'))
+        )
+        for local, path in node.outputs:
+            container, obj = self.store.parse(path)
+            if obj is None:
+                continue
+            dest = self.store.object_path(container, obj)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            shutil.copyfile(local, dest)
+        # Hand the output channels over to the nodes connected to this one.
+        for dest in node.group['connect']:
+            for dest_node in nodes[dest]:
+                os.rename(
+                    os.path.join(node.sandbox, 'dev', 'out', dest_node.name),
+                    os.path.join(dest_node.sandbox, 'dev', 'in', node.name)
+                )
+
+    def _read_stdout(self, node):
+        with open(os.path.join(node.sandbox, 'stdout')) as fp:
+            return fp.read()
+
+
+def _run_child(sandbox, app_dir, script, *args):
+    """Executed in the child process: run ``script`` with its ``/dev`` paths
+    redirected to ``sandbox``.
+    """
+    import __builtin__
+    real_stat = os.stat
+
+    def real_exists(path):
+        try:
+            real_stat(path)
+        except OSError:
+            return False
+        return True
+
+    def local_path(path):
+        if isinstance(path, basestring) and path.startswith('/'):
+            if path == '/dev' or path.startswith('/dev/'):
+                candidate = os.path.join(sandbox, path[1:])
+            else:
+                candidate = os.path.join(app_dir, path[1:])
+            if real_exists(candidate):
+                return candidate
+        return path
+
+    def redirect(func):
+        def wrapper(path, *args, **kwargs):
+            return func(local_path(path), *args, **kwargs)
+        return wrapper
+
+    # `os.path.exists`, `os.path.getsize` and friends all use `os.stat`.
+    __builtin__.open = redirect(open)
+    os.stat = redirect(os.stat)
+    os.listdir = redirect(os.listdir)
+    sqlite3.connect = redirect(sqlite3.connect)
+
+    sys.argv = [script] + list(args)
+    sys.path.insert(0, app_dir)
+    execfile(script, {'__name__': '__main__', '__file__': script})
+
+
+def _env_pair(value):
+    key, sep, val = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError('expected KEY=VALUE: %r' % value)
+    return key, val
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('job', help='Job description (JSON) or zapp.yaml')
+    parser.add_argument('--store', default='store',
+                        help='Directory holding the containers')
+    parser.add_argument('--app', default='.',
+                        help='Directory holding the application files')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python interpreter to run the nodes with')
+    parser.add_argument('--processes', type=int,
+                        help='Number of nodes to run at the same time '
+                             '(default: number of CPUs)')
+    parser.add_argument('--env', type=_env_pair, action='append',
+                        default=[], metavar='KEY=VALUE',
+                        help='Request environment variable')
+    parser.add_argument('--stdin', type=argparse.FileType('r'),
+                        help='File to send as the request body')
+    parser.add_argument('--keep', action='store_true',
+                        help="Don't delete the scratch directories")
+    parser.add_argument('--timings', action='store_true',
+                        help='Print the time taken by each node to stderr')
+    args = parser.parse_args(argv)
+
+    cloud = LocalZeroCloud(args.store, args.app, python=args.python,
+                           processes=args.processes, keep=args.keep)
+    stdin = args.stdin.read() if args.stdin else ''
+    env = dict(args.env)
+    if stdin:
+        env.setdefault('CONTENT_LENGTH', str(len(stdin)))
+    try:
+        result = cloud.execute(load_job(args.job), env=env, stdin=stdin)
+    except JobFailed as exc:
+        sys.exit('localzc: %s' % exc)
+    sys.stdout.write(result.output)
+    if args.timings:
+        for name, elapsed in result.timings:
+            print >>sys.stderr, '%-30s %8.3f' % (name, elapsed)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['_child']:
+        _run_child(*sys.argv[2:])
+    else:
+        main()
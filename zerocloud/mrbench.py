@@ -0,0 +1,167 @@
+"""Benchmarks for the MapReduce word count example.
+
+Run this locally (outside of ZeroVM) to compare the different modes of
+``mrmapper.py``::
+
+    $ python mrbench.py mapper --size 256
+
+or the text and binary record formats read by ``mrreducer.py``::
+
+    $ python mrbench.py reducer --records 10000000
+
+Each mode runs in a fresh process, so the peak RSS reported for it is not
+skewed by the other runs.
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mrmapper
+import mrreducer
+import mrrecords
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+MAPPER_MODES = {
+    'read': mrmapper.count_words,
+    'stream': mrmapper.count_words_stream,
+}
+
+RECORD_FORMATS = {
+    'text': mrrecords.TextRecordWriter,
+    'binary': mrrecords.BinaryRecordWriter,
+}
+
+
+def make_corpus(path, size_mb, seed=0):
+    """Write roughly ``size_mb`` megabytes of random words to ``path``."""
+    rand = random.Random(seed)
+    line_words = 12
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, 'w') as fp:
+        while written < target:
+            lines = [' '.join(rand.choice(WORDS) for _ in range(line_words))
+                     for _ in range(1000)]
+            block = '\n'.join(lines) + '\n'
+            fp.write(block)
+            written += len(block)
+
+
+def make_records(inp_dir, num_records, record_format, num_files=10, seed=0):
+    """Write ``num_records`` mapper records to ``num_files`` files in
+    ``inp_dir``, the way they would arrive at a reducer.
+    """
+    rand = random.Random(seed)
+    writer_class = RECORD_FORMATS[record_format]
+    per_file = num_records // num_files
+    for i in range(num_files):
+        with open(os.path.join(inp_dir, 'map-%d' % (i + 1)), 'w') as fp:
+            writer = writer_class(fp)
+            for j in range(per_file):
+                writer.write(rand.randint(0, 100000),
+                             'mapreduce-data/%d-%d.txt' % (i, j))
+
+
+def _run_child(kind, mode, path):
+    """Executed in the child process: run one mode and report."""
+    start = time.time()
+    if kind == 'mapper':
+        with open(path) as fp:
+            count = MAPPER_MODES[mode](fp)
+    else:
+        records = mrreducer.read_records(path, binary=(mode == 'binary'))
+        _top, count = mrreducer.reduce_top(records, 10)
+    elapsed = time.time() - start
+    print '%d %f' % (count, elapsed)
+
+
+def _run_mode(kind, mode, path):
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '_child', kind, mode,
+         path],
+        stdout=subprocess.PIPE,
+    )
+    output = proc.stdout.read()
+    _pid, status, rusage = os.wait4(proc.pid, 0)
+    if status != 0:
+        raise RuntimeError('%s mode %r failed' % (kind, mode))
+    count, elapsed = output.split()
+    # ru_maxrss is in kilobytes on Linux.
+    return int(count), float(elapsed), rusage.ru_maxrss / 1024.0
+
+
+def bench_mapper(args):
+    fd, path = tempfile.mkstemp(prefix='mrbench-', suffix='.txt')
+    os.close(fd)
+    try:
+        make_corpus(path, args.size)
+        size_mb = os.path.getsize(path) / (1024.0 * 1024.0)
+        print '%-8s %12s %10s %10s %12s' % ('mode', 'words', 'seconds',
+                                             'MB/s', 'peak RSS MB')
+        counts = set()
+        for mode in args.modes:
+            count, elapsed, rss = _run_mode('mapper', mode, path)
+            counts.add(count)
+            print '%-8s %12d %10.3f %10.1f %12.1f' % (
+                mode, count, elapsed, size_mb / elapsed, rss)
+        if len(counts) > 1:
+            print >>sys.stderr, 'WARNING: modes disagree on the word count'
+    finally:
+        os.unlink(path)
+
+
+def bench_reducer(args):
+    print '%-8s %12s %10s %10s %12s' % ('format', 'total', 'seconds',
+                                         'records/s', 'peak RSS MB')
+    totals = set()
+    for record_format in args.formats:
+        inp_dir = tempfile.mkdtemp(prefix='mrbench-')
+        try:
+            make_records(inp_dir, args.records, record_format)
+            total, elapsed, rss = _run_mode('reducer', record_format, inp_dir)
+        finally:
+            shutil.rmtree(inp_dir)
+        totals.add(total)
+        print '%-8s %12d %10.3f %10d %12.1f' % (
+            record_format, total, elapsed, args.records / elapsed, rss)
+    if len(totals) > 1:
+        print >>sys.stderr, 'WARNING: formats disagree on the total'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    mapper = subparsers.add_parser(
+        'mapper', help='Compare mrmapper.py word count modes')
+    mapper.add_argument('--size', type=int, default=64,
+                        help='Size of the generated input in MB')
+    mapper.add_argument('--modes', nargs='+', default=sorted(MAPPER_MODES),
+                        choices=sorted(MAPPER_MODES))
+    mapper.set_defaults(func=bench_mapper)
+
+    reducer = subparsers.add_parser(
+        'reducer', help='Compare mrreducer.py record formats')
+    reducer.add_argument('--records', type=int, default=10 * 1000 * 1000,
+                         help='Number of mapper records to reduce')
+    reducer.add_argument('--formats', nargs='+',
+                         default=sorted(RECORD_FORMATS),
+                         choices=sorted(RECORD_FORMATS))
+    reducer.set_defaults(func=bench_reducer)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['_child']:
+        _run_child(*sys.argv[2:])
+    else:
+        main()
@@ -1,14 +1,135 @@
+import collections
 import os
+import re
+import string
+import sys
+import zlib
 
-# Word count:
-with open('/dev/input') as fp:
+import mrrecords
+
+# Read /dev/input in blocks of this size when streaming (``--stream``):
+CHUNK_SIZE = 1024 * 1024
+
+OUT_DIR = '/dev/out'
+
+
+def count_words(fp):
+    """Word count, reading the entire input into memory at once."""
     data = fp.read()
+    return len(data.split())
+
+
+def count_words_stream(fp, chunk_size=CHUNK_SIZE):
+    """Word count, reading the input in fixed-size chunks.
+
+    Memory use is bounded by ``chunk_size``, no matter how big the input is.
+    A word which is split across two chunks is only counted once.
+    """
+    count = 0
+    in_word = False
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        count += len(chunk.split())
+        if in_word and not chunk[0].isspace():
+            # The first word of this chunk is the tail end of the last word
+            # of the previous chunk.
+            count -= 1
+        in_word = not chunk[-1].isspace()
+    return count
+
+
+def iter_words(fp, chunk_size=CHUNK_SIZE):
+    """Yield each word in the input, reading it in fixed-size chunks."""
+    partial = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        words = (partial + chunk).split()
+        if words and not chunk[-1].isspace():
+            # The last word may continue in the next chunk.
+            partial = words.pop()
+        else:
+            partial = ''
+        for word in words:
+            yield word
+    if partial:
+        yield partial
+
+
+def word_frequencies(fp, chunk_size=CHUNK_SIZE):
+    """Count how many times each word occurs in the input.
+
+    This is the map-side combiner: instead of emitting one record per word
+    occurrence, the counts are combined locally so that only one record per
+    distinct word has to be sent to the reducer. Words are lowercased and
+    stripped of surrounding punctuation.
+    """
+    counts = collections.Counter()
+    for word in iter_words(fp, chunk_size):
+        word = word.strip(string.punctuation).lower()
+        if word:
+            counts[word] += 1
+    return counts
+
+
+def reduce_channels(out_dir=OUT_DIR):
+    """Return the paths of the channels to the ``reduce`` group.
+
+    If the ``reduce`` group has a ``count`` greater than 1, ZeroCloud creates
+    one channel per reducer node (``reduce-1``, ``reduce-2``, etc.), so the
+    number of partitions is set in the job definition, not here.
+    """
+    names = [name for name in os.listdir(out_dir)
+             if re.match(r'^reduce(-\d+)?$', name)]
+    names.sort(key=lambda name: int(name.partition('-')[2] or 0))
+    return [os.path.join(out_dir, name) for name in names]
+
+
+def partition(key, num_partitions):
+    """Pick the partition for ``key``.
+
+    Every mapper must send a given key to the same reducer, so this has to be
+    stable across processes.
+    """
+    return (zlib.crc32(key) & 0xffffffff) % num_partitions
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    if '--words' in args:
+        # Word frequencies:
+        with open('/dev/input') as fp:
+            counts = word_frequencies(fp)
+        records = [(count, word) for word, count in counts.iteritems()]
+    else:
+        # Word count:
+        with open('/dev/input') as fp:
+            if '--stream' in args:
+                count = count_words_stream(fp)
+            else:
+                count = count_words(fp)
+
+        path_info = os.environ['LOCAL_PATH_INFO']
+        # Split off the swift prefix
+        # Just show the container/file
+        shorter = '/'.join(path_info.split('/')[2:])
+        records = [(count, shorter)]
 
-with open('/dev/out/reduce', 'a') as fp:
-    path_info = os.environ['LOCAL_PATH_INFO']
+    if '--binary' in args:
+        writer_class = mrrecords.BinaryRecordWriter
+    else:
+        writer_class = mrrecords.TextRecordWriter
 
-    # Split off the swift prefix
-    # Just show the container/file
-    shorter = '/'.join(path_info.split('/')[2:])
-    # Pipe the output to the reducer:
-    print >>fp, '%d %s' % (len(data.split()), shorter)
+    # Pipe the output to the reducer(s):
+    channels = [open(path, 'a') for path in reduce_channels()]
+    try:
+        writers = [writer_class(fp) for fp in channels]
+        for count, key in records:
+            writers[partition(key, len(writers))].write(count, key)
+    finally:
+        for fp in channels:
+            fp.close()
@@ -0,0 +1,69 @@
+"""Record formats for passing ``(count, key)`` records between the mappers and
+reducers of the MapReduce example.
+
+The text format is one ``count key`` line per record. In the binary format,
+each record is a fixed-size header, holding the count and the length of the
+key, followed by the key itself. Reading these back needs no tokenizing or
+``int()`` parsing, which is where most of the reducer's time goes with the
+plain text format.
+"""
+import struct
+
+# count (unsigned 64-bit), key length (unsigned 32-bit), little-endian:
+HEADER = struct.Struct('<QI')
+
+# Decode records from blocks of this size:
+CHUNK_SIZE = 1024 * 1024
+
+
+class TextRecordWriter(object):
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, count, key):
+        print >>self.fp, '%d %s' % (count, key)
+
+
+class BinaryRecordWriter(object):
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, count, key):
+        self.fp.write(HEADER.pack(count, len(key)) + key)
+
+
+def read_text_records(fp):
+    """Yield each ``(count, key)`` record in the text file ``fp``."""
+    for line in fp:
+        count, key = line.split()
+        yield int(count), key
+
+
+def read_binary_records(fp, chunk_size=CHUNK_SIZE):
+    """Yield each ``(count, key)`` record in the binary file ``fp``.
+
+    Records are decoded a block at a time, straight from the buffer.
+    """
+    header_size = HEADER.size
+    unpack_from = HEADER.unpack_from
+    buf = ''
+    while True:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        buf = buf + chunk if buf else chunk
+        end = len(buf)
+        offset = 0
+        while offset + header_size <= end:
+            count, key_len = unpack_from(buf, offset)
+            start = offset + header_size
+            if start + key_len > end:
+                # The rest of this record is in the next block.
+                break
+            offset = start + key_len
+            yield count, buf[start:offset]
+        buf = buf[offset:]
+    if buf:
+        raise ValueError('Truncated record at end of input')
@@ -1,25 +1,129 @@
-import os
+import argparse
+import collections
+import heapq
 import math
+import os
+
+import mrrecords
 
 inp_dir = '/dev/in'
 
-total = 0
-max_count = 0
+# Channel to the ``merge`` group, used with ``--partial``:
+merge_channel = '/dev/out/merge'
+
+
+def read_records(inp_dir, binary=False):
+    """Yield each ``(count, key)`` record sent by the mappers."""
+    if binary:
+        read = mrrecords.read_binary_records
+    else:
+        read = mrrecords.read_text_records
+
+    for inp_file in os.listdir(inp_dir):
+        with open(os.path.join(inp_dir, inp_file)) as fp:
+            for record in read(fp):
+                yield record
+
+
+def make_format(max_count):
+    return '%%%sd %%s' % (int(math.log10(max(max_count, 1))) + 2)
+
+
+def reduce_counts(records):
+    """Collect the word count of each object, in the order they arrive.
+
+    Returns the list of records and the total word count.
+    """
+    total = 0
+
+    data = []
+
+    for count, filename in records:
+        data.append((count, filename))
+        total += count
+
+    return data, total
+
+
+def reduce_top(records, k):
+    """Find the ``k`` objects with the highest word count, largest first.
+
+    The records are aggregated as they are read, so only ``k`` of them are
+    held in memory at any time. Returns the top records and the total word
+    count.
+    """
+    total = 0
+    # Min-heap of the ``k`` largest records seen so far:
+    top = []
+
+    for record in records:
+        total += record[0]
+        if len(top) < k:
+            heapq.heappush(top, record)
+        elif record > top[0]:
+            heapq.heapreplace(top, record)
+
+    return sorted(top, reverse=True), total
+
+
+def reduce_words(records, k=None):
+    """Merge the word frequencies from all mappers, most frequent first. If
+    ``k`` is given, only keep the ``k`` most frequent words.
+
+    Returns the ``(count, word)`` records and the total word count.
+    """
+    counts = collections.Counter()
+    for count, word in records:
+        counts[word] += count
+
+    total = sum(counts.itervalues())
+    return [(count, word) for word, count in counts.most_common(k)], total
+
+
+def print_report(data, total):
+    fmt = make_format(total)
+
+    for count, key in data:
+        print fmt % (count, key)
+    print fmt % (total, 'total')
 
-data = []
 
-for inp_file in os.listdir(inp_dir):
-    with open(os.path.join(inp_dir, inp_file)) as fp:
-        for line in fp:
-            count, filename = line.split()
-            count = int(count)
-            if count > max_count:
-                max_count = count
-            data.append((count, filename))
-            total += count
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--words', action='store_true',
+                        help='Merge word frequencies instead of word counts')
+    parser.add_argument('--top', type=int, metavar='K',
+                        help='Only keep the K largest counts')
+    parser.add_argument('--binary', action='store_true',
+                        help='Read (and send, with --partial) records in the '
+                             'binary format')
+    parser.add_argument('--partial', action='store_true',
+                        help='Send the reduced records on to the merge group '
+                             'instead of printing them')
+    args = parser.parse_args()
+    if args.top is not None and args.top < 1:
+        parser.error('--top must be at least 1')
+    if args.partial and args.top is not None:
+        # The total would only include the records which made the cut.
+        parser.error('--top cannot be combined with --partial, '
+                     'give it to the merge group instead')
 
-fmt = '%%%sd %%s' % (int(math.log10(max_count)) + 2)
+    records = read_records(inp_dir, binary=args.binary)
+    if args.words:
+        data, total = reduce_words(records, k=args.top)
+    elif args.top is not None:
+        data, total = reduce_top(records, args.top)
+    else:
+        data, total = reduce_counts(records)
 
-for count, filename in data:
-    print fmt % (count, filename)
-print fmt % (total, 'total')
+    if args.partial:
+        if args.binary:
+            writer_class = mrrecords.BinaryRecordWriter
+        else:
+            writer_class = mrrecords.TextRecordWriter
+        with open(merge_channel, 'a') as fp:
+            writer = writer_class(fp)
+            for count, key in data:
+                writer.write(count, key)
+    else:
+        print_report(data, total)
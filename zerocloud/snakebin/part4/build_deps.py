@@ -0,0 +1,96 @@
+"""Package the dependencies of Snakebin as a precompiled zip archive.
+
+ZeroVM can't write to the file system of the zapp, so Python can't save the
+bytecode it compiles: every job compiles each module it imports from source,
+every time it starts. Run this before ``zpm bundle``, with the same version of
+Python as ZeroVM (2.7), to compile the dependencies listed in ``zapp.yaml``
+ahead of time::
+
+    $ python build_deps.py
+
+and add ``deps.zip`` to the ``bundling`` list in ``zapp.yaml``. The archive is
+a build product, so it isn't checked in or listed there by default: without
+it, the dependencies are imported from source, as bundled by ``zpm``.
+
+The modules are compiled from wherever they are installed locally, and only
+the bytecode is written to ``deps.zip``, which ``snakebin.py`` puts at the
+front of ``sys.path``. Python can import straight from a zip file (with
+``zipimport``), and reads a single archive instead of looking for each module
+in several directories. The archive isn't compressed, so there is nothing to
+decompress either.
+"""
+import argparse
+import imp
+import marshal
+import os
+import struct
+import sys
+import time
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PACKAGES = ('falcon', 'six', 'mimeparse')
+DEFAULT_OUTPUT = os.path.join(HERE, 'deps.zip')
+
+
+def compile_source(path, arcname):
+    """Compile the source file ``path``, and return the contents of the
+    ``.pyc`` file for it. ``arcname`` is the file name used in tracebacks.
+    """
+    with open(path, 'U') as fp:
+        source = fp.read()
+    code = compile(source + '\n', arcname, 'exec')
+    mtime = int(os.stat(path).st_mtime)
+    return imp.get_magic() + struct.pack('<I', mtime) + marshal.dumps(code)
+
+
+def module_files(name):
+    """Yield ``(path, arcname)`` for each source file of the module or
+    package ``name``, as it is installed locally.
+    """
+    module = __import__(name)
+    path = module.__file__
+    if os.path.splitext(path)[0].endswith('__init__'):
+        root = os.path.dirname(path)
+        base = os.path.dirname(root)
+        for dirpath, _dirnames, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                full_path = os.path.join(dirpath, filename)
+                if filename.endswith('.py'):
+                    yield full_path, os.path.relpath(full_path, base)
+                elif filename.endswith(('.so', '.pyd')):
+                    # Extension modules can't be imported from a zip file.
+                    print >>sys.stderr, 'skipping extension module %s' % (
+                        full_path)
+    else:
+        source = os.path.splitext(path)[0] + '.py'
+        yield source, os.path.basename(source)
+
+
+def build(packages, output):
+    count = 0
+    with zipfile.ZipFile(output, 'w') as archive:
+        for name in packages:
+            for path, arcname in module_files(name):
+                arcname = os.path.splitext(arcname)[0] + '.pyc'
+                info = zipfile.ZipInfo(arcname,
+                                       time.localtime(os.stat(path).st_mtime))
+                archive.writestr(info, compile_source(path, arcname))
+                count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('packages', nargs='*', default=DEFAULT_PACKAGES,
+                        help='Modules and packages to include')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args(argv)
+    if sys.version_info[:2] != (2, 7):
+        sys.exit('bytecode has to be compiled with Python 2.7, like ZeroVM')
+    count = build(args.packages, args.output)
+    print 'wrote %d modules to %s' % (count, args.output)
+
+
+if __name__ == '__main__':
+    main()
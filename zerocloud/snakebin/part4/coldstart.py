@@ -0,0 +1,122 @@
+"""Cold-start benchmark for the Snakebin router.
+
+ZeroCloud starts the router in a new process for every request, so the time
+it takes Python to start it up and import everything counts towards every
+request. This runs ``snakebin.py`` for a few typical requests, in a new
+process each time, with each way the router can dispatch a request
+(``SNAKEBIN_DISPATCH``), and compares how long it takes::
+
+    $ python coldstart.py --runs 50
+
+The app is copied to a temporary directory first, and Python is run with
+``-B``, so no bytecode is saved between runs: like in ZeroVM, every module is
+compiled from source each time (unless it is in ``deps.zip``). Falcon has to
+be importable, from ``deps.zip`` or from ``PYTHONPATH``.
+
+Only the router runs, not the jobs it starts, so the requests don't need a
+store or any devices.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from timing import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ('falcon', 'oneshot')
+BASE_PATH = '/local/snakebin-api'
+# (name, method, path, query string, request body):
+REQUESTS = [
+    ('page', 'GET', BASE_PATH + '/', '', ''),
+    ('execute', 'POST', BASE_PATH + '/execute', '', 'print "hello"\n'),
+    ('search', 'GET', BASE_PATH + '/search', 'q=print&limit=10', ''),
+    ('not-found', 'GET', BASE_PATH + '/a/b/c/d', '', ''),
+]
+
+
+def copy_app(dest):
+    """Copy the app to ``dest``, without any saved bytecode."""
+    shutil.copytree(HERE, dest, ignore=shutil.ignore_patterns('*.pyc'))
+
+
+def run_request(app_dir, mode, method, path, query, body):
+    """Run the router once, and return ``(seconds, status)``."""
+    env = dict(os.environ)
+    env.update({
+        'SNAKEBIN_DISPATCH': mode,
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+    })
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, '-B', os.path.join(app_dir, 'snakebin.py')],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, cwd=app_dir, env=env,
+    )
+    out, err = proc.communicate(body)
+    elapsed = time.time() - start
+    if proc.returncode != 0:
+        sys.exit('%s %s failed in %s mode:\n%s' % (method, path, mode, err))
+    # Only compare the status, not the protocol version of the status line.
+    return elapsed, out.split('\r\n', 1)[0].split(' ', 1)[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the cold-start time of the Snakebin router '
+                    'with each way of dispatching requests')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Runs of each request with each mode')
+    parser.add_argument('--mode', action='append', choices=MODES,
+                        help='Modes to compare (default: all)')
+    args = parser.parse_args(argv)
+    modes = args.mode or MODES
+
+    workdir = tempfile.mkdtemp(prefix='snakebin-coldstart-')
+    try:
+        app_dir = os.path.join(workdir, 'app')
+        copy_app(app_dir)
+        # {(request, mode): [seconds]}, {(request, mode): status}
+        times = {}
+        statuses = {}
+        for _ in range(args.runs):
+            # Alternate between the modes, so that anything else going on in
+            # the machine affects all of them the same.
+            for name, method, path, query, body in REQUESTS:
+                for mode in modes:
+                    elapsed, status = run_request(app_dir, mode, method,
+                                                  path, query, body)
+                    times.setdefault((name, mode), []).append(elapsed)
+                    statuses[name, mode] = status
+    finally:
+        shutil.rmtree(workdir)
+
+    print '%-10s %-8s %9s %9s %9s %8s' % (
+        'request', 'mode', 'p50 ms', 'p95 ms', 'mean ms', 'vs. ' + modes[0])
+    for name, _method, _path, _query, _body in REQUESTS:
+        baseline = None
+        for mode in modes:
+            values = sorted(times[name, mode])
+            median = percentile(values, 50) * 1000
+            if baseline is None:
+                baseline = median
+            print '%-10s %-8s %9.1f %9.1f %9.1f %7.2fx' % (
+                name, mode, median, percentile(values, 95) * 1000,
+                sum(values) / len(values) * 1000, median / baseline)
+        if len(set(statuses[name, mode] for mode in modes)) > 1:
+            print >>sys.stderr, 'warning: %s got different responses: %s' % (
+                name, ', '.join('%s: %s' % (mode, statuses[name, mode])
+                                for mode in modes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Merge the deltas of the Snakebin search index into its shards.
+
+Save jobs never change the shards of the index: each one writes the trigrams
+of the scripts it saves to deltas of their own, in ``snakebin-index-delta``.
+Searches have to check every delta, and the router stops using the index
+altogether once there are more than ``SNAKEBIN_MAX_INDEX_DELTAS`` of them, so
+run this regularly (for example, from cron), with the same credentials as the
+``swift`` command::
+
+    $ python compact_index.py
+
+Only one copy should run at a time, since it rewrites the shards. Deltas which
+are saved while it runs are left for the next run. A delta is only deleted
+once the shards with its trigrams have been uploaded, so a search never misses
+a script, and merging the same delta twice does no harm.
+"""
+import argparse
+import collections
+import os
+import sqlite3
+import tempfile
+
+import swiftclient
+
+import search_index
+
+# Merge at most this many deltas per round, to keep their postings in memory:
+DEFAULT_BATCH_SIZE = 1000
+
+
+def connect():
+    return swiftclient.Connection(
+        preauthurl=os.environ['OS_STORAGE_URL'],
+        preauthtoken=os.environ['OS_AUTH_TOKEN'],
+    )
+
+
+def read_postings(conn, names):
+    """Download the deltas of the scripts ``names``, and return their
+    postings, as a dict of shard -> trigram -> set of names.
+    """
+    shards = collections.defaultdict(lambda: collections.defaultdict(set))
+    for name in names:
+        _headers, data = conn.get_object(search_index.DELTA_CONTAINER, name)
+        for trigram in search_index.read_delta(data):
+            shards[search_index.shard_of(trigram)][trigram].add(name)
+    return shards
+
+
+def update_shard(conn, shard, postings):
+    """Add ``postings`` (a dict of trigram -> set of names) to ``shard``."""
+    shard_name = search_index.SHARD_NAME % shard
+    fd, path = tempfile.mkstemp(suffix='.db')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            try:
+                _headers, data = conn.get_object(
+                    search_index.INDEX_CONTAINER, shard_name)
+            except swiftclient.ClientException as exc:
+                if exc.http_status != 404:
+                    raise
+                data = ''
+            fp.write(data)
+        db = sqlite3.connect(path)
+        with db:
+            search_index.add_postings(db, postings)
+        db.close()
+        with open(path) as fp:
+            conn.put_object(search_index.INDEX_CONTAINER, shard_name, fp,
+                            content_type='application/octet-stream')
+    finally:
+        os.unlink(path)
+
+
+def compact(conn, batch_size=DEFAULT_BATCH_SIZE):
+    """Merge the deltas into the shards, ``batch_size`` at a time, and
+    delete them. Returns the number of deltas merged.
+    """
+    _headers, objects = conn.get_container(search_index.DELTA_CONTAINER,
+                                           full_listing=True)
+    names = [obj['name'] for obj in objects]
+    for i in range(0, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        for shard, postings in sorted(read_postings(conn, batch).items()):
+            update_shard(conn, shard, postings)
+        for name in batch:
+            conn.delete_object(search_index.DELTA_CONTAINER, name)
+    return len(names)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of deltas to merge at a time')
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error('--batch-size must be at least 1')
+    count = compact(connect(), batch_size=args.batch_size)
+    print 'merged %d deltas' % count
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""A one-shot request dispatcher for the Snakebin router.
+
+ZeroCloud runs the router in a new process for every request, so there is
+only ever one request to handle. Falcon and ``wsgiref`` are built for serving
+many requests from one process: they take longer to import and set up than it
+takes to handle a Snakebin request. This module handles the request straight
+from the environment ZeroCloud gives the router instead, and writes the
+response to stdout itself.
+
+``Request`` and ``Response`` only have the parts of Falcon's request and
+response objects which the handlers in ``snakebin.py`` use, and middleware
+works the same way, so the same handlers run with either of them.
+"""
+import os
+import re
+import sys
+import traceback
+import urlparse
+
+HTTP_200 = '200 OK'
+HTTP_302 = '302 Found'
+HTTP_304 = '304 Not Modified'
+HTTP_400 = '400 Bad Request'
+HTTP_404 = '404 Not Found'
+HTTP_405 = '405 Method Not Allowed'
+HTTP_413 = '413 Payload Too Large'
+HTTP_500 = '500 Internal Server Error'
+
+# Falcon's default content type:
+DEFAULT_CONTENT_TYPE = 'application/json; charset=UTF-8'
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'DELETE', 'OPTIONS', 'PATCH')
+
+
+class HTTPError(Exception):
+    """Raised to respond with the error ``status`` instead."""
+
+    def __init__(self, status, message=''):
+        Exception.__init__(self, status)
+        self.status = status
+        self.message = message
+
+
+class Request(object):
+
+    def __init__(self, environ, stream):
+        self.env = environ
+        self.method = environ['REQUEST_METHOD']
+        self.path = environ.get('PATH_INFO') or '/'
+        if len(self.path) > 1 and self.path.endswith('/'):
+            # Like Falcon, ignore a trailing slash.
+            self.path = self.path[:-1]
+        self.stream = stream
+        self._params = None
+
+    @property
+    def content_length(self):
+        value = self.env.get('CONTENT_LENGTH')
+        if not value:
+            return None
+        try:
+            length = int(value)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HTTPError(HTTP_400, 'Invalid Content-Length header.')
+        return length
+
+    def get_header(self, name):
+        name = name.upper().replace('-', '_')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            return self.env.get(name) or None
+        return self.env.get('HTTP_' + name)
+
+    @property
+    def params(self):
+        """The query string parameters. Parameters which are given more than
+        once have a list of values.
+        """
+        if self._params is None:
+            self._params = {}
+            query = urlparse.parse_qs(self.env.get('QUERY_STRING', ''))
+            for name, values in query.items():
+                self._params[name] = values[0] if len(values) == 1 else values
+        return self._params
+
+    def get_param_as_int(self, name, min=None):
+        value = self.params.get(name)
+        if value is None:
+            return None
+        if isinstance(value, list):
+            value = value[-1]
+        try:
+            value = int(value)
+        except ValueError:
+            raise HTTPError(HTTP_400, 'Invalid value for %s.' % name)
+        if min is not None and value < min:
+            raise HTTPError(HTTP_400, 'Invalid value for %s.' % name)
+        return value
+
+
+class Response(object):
+
+    def __init__(self):
+        self.status = HTTP_200
+        # Header names are case-insensitive: map the lower-case name to the
+        # name as it was given, and the value.
+        self._headers = {}
+        self.content_type = DEFAULT_CONTENT_TYPE
+        self.body = None
+        self.data = None
+        self.stream = None
+        self.stream_len = None
+
+    @property
+    def content_type(self):
+        return self.get_header('Content-Type')
+
+    @content_type.setter
+    def content_type(self, value):
+        self.set_header('Content-Type', value)
+
+    @property
+    def location(self):
+        return self.get_header('Location')
+
+    @location.setter
+    def location(self, value):
+        self.set_header('Location', value)
+
+    def get_header(self, name):
+        return self._headers.get(name.lower(), (name, None))[1]
+
+    def set_header(self, name, value):
+        self._headers[name.lower()] = (name, str(value))
+
+    def set_headers(self, headers):
+        for name, value in headers.items():
+            self.set_header(name, value)
+
+    def set_stream(self, stream, stream_len):
+        self.stream = stream
+        self.stream_len = stream_len
+
+    def write(self, out):
+        """Write the response to the file ``out``."""
+        if self.body is not None:
+            body = self.body
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            parts, length = [body], len(body)
+        elif self.data is not None:
+            parts, length = [self.data], len(self.data)
+        elif self.stream is not None:
+            parts, length = self.stream, self.stream_len
+        else:
+            parts, length = [], 0
+        if length is not None and self.get_header('Content-Length') is None:
+            self.set_header('Content-Length', length)
+
+        head = ['HTTP/1.1 %s' % self.status]
+        head.extend('%s: %s' % header for header in self._headers.values())
+        out.write('\r\n'.join(head) + '\r\n\r\n')
+        if hasattr(parts, 'read'):
+            while True:
+                chunk = parts.read(64 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+        else:
+            for part in parts:
+                out.write(part)
+        out.flush()
+
+
+class Router(object):
+    """Match request paths against URI templates like Falcon's
+    (``/{account}/{container}``). Each template is compiled into a regular
+    expression once, when it is added.
+    """
+
+    def __init__(self, routes=()):
+        self.routes = []
+        for template, resource in routes:
+            self.add_route(template, resource)
+
+    def add_route(self, template, resource):
+        # Odd items are the names of the fields, even items the text
+        # between them.
+        parts = re.split(r'{(\w+)}', template)
+        pattern = ''.join(
+            '(?P<%s>[^/]+)' % part if i % 2 else re.escape(part)
+            for i, part in enumerate(parts))
+        self.routes.append((re.compile(pattern + '$'), resource))
+
+    def find(self, path):
+        """Return the resource for ``path``, and the parameters taken from
+        the path, or ``(None, None)`` if no route matches.
+        """
+        for pattern, resource in self.routes:
+            match = pattern.match(path)
+            if match is not None:
+                return resource, match.groupdict()
+        return None, None
+
+
+def _error(resp, status, message=''):
+    resp.status = status
+    if message:
+        resp.content_type = 'text/plain'
+        resp.body = message + '\n'
+
+
+def run(router, middleware=(), environ=None, stdin=None, stdout=None):
+    """Handle the one request described by ``environ`` (by default, the
+    environment of the process), calling ``on_get``, ``on_post`` and so on of
+    the matching resource, and the hooks of the ``middleware`` components,
+    like Falcon does.
+    """
+    req = Request(os.environ if environ is None else environ,
+                  sys.stdin if stdin is None else stdin)
+    resp = Response()
+    resource = None
+    try:
+        for component in middleware:
+            if hasattr(component, 'process_request'):
+                component.process_request(req, resp)
+        resource, params = router.find(req.path)
+        if resource is None:
+            _error(resp, HTTP_404)
+        else:
+            for component in middleware:
+                if hasattr(component, 'process_resource'):
+                    component.process_resource(req, resp, resource, params)
+            responder = None
+            if req.method in METHODS:
+                responder = getattr(resource, 'on_' + req.method.lower(),
+                                    None)
+            if responder is None:
+                allowed = [method for method in METHODS
+                           if hasattr(resource, 'on_' + method.lower())]
+                resp.set_header('Allow', ', '.join(allowed))
+                _error(resp, HTTP_405)
+            else:
+                responder(req, resp, **params)
+        succeeded = True
+    except HTTPError as exc:
+        resp = Response()
+        _error(resp, exc.status, exc.message)
+        succeeded = False
+    except Exception:
+        traceback.print_exc()
+        resp = Response()
+        _error(resp, HTTP_500)
+        succeeded = False
+    for component in reversed(middleware):
+        if hasattr(component, 'process_response'):
+            component.process_response(req, resp, resource, succeeded)
+    resp.write(sys.stdout if stdout is None else stdout)
@@ -0,0 +1,149 @@
+import marshal
+import os
+import shutil
+import sqlite3
+
+import snakebin
+
+page_template = snakebin.PageTemplate('/index.html')
+
+
+def read_contents():
+    with open('/dev/input') as fp:
+        return fp.read()
+
+
+def load_code():
+    """Load the compiled code for the script.
+
+    If the script has been executed before, the bytecode is loaded from
+    `/dev/bytecode`. Otherwise, the script is compiled and the bytecode is
+    saved to `/dev/bytecode`. If the saved bytecode can't be loaded (for
+    example, because the job which saved it was cut short), the script is
+    compiled again.
+    """
+    if os.environ.get('SNAKEBIN_BYTECODE') == 'load':
+        with open('/dev/bytecode') as fp:
+            try:
+                return marshal.load(fp)
+            except (EOFError, ValueError, TypeError):
+                pass
+
+    code = snakebin.compile_code(read_contents())
+    if os.environ.get('SNAKEBIN_BYTECODE') == 'save':
+        with open('/dev/bytecode', 'a') as fp:
+            marshal.dump(code, fp)
+    return code
+
+
+class TeeWriter(object):
+    """File-like object which writes everything to all of the ``fps``."""
+
+    def __init__(self, *fps):
+        self.fps = fps
+
+    def write(self, data):
+        for fp in self.fps:
+            fp.write(data)
+
+    def flush(self):
+        for fp in self.fps:
+            fp.flush()
+
+
+class CacheBuffer(object):
+    """File-like object which keeps up to ``limit`` bytes written to it.
+
+    If more than that is written, everything is dropped, and ``full`` is set.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.full = False
+        self._chunks = []
+
+    def write(self, data):
+        if self.full:
+            return
+        self.size += len(data)
+        if self.size > self.limit:
+            self.full = True
+            self._chunks = []
+        else:
+            self._chunks.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+def save_output(output):
+    """Add the ``output`` of the script to the cache.
+
+    Like the inline store, the cache is read from `/dev/cache`, and the
+    updated copy written to `/dev/cache-new`, which is mapped to the same
+    object.
+    """
+    cache_key = os.environ['SNAKEBIN_CACHE_KEY']
+    with snakebin.update_database('/dev/cache', '/dev/cache-new') as conn:
+        snakebin.execute_cache.create_table(conn)
+        conn.execute('INSERT OR REPLACE INTO output VALUES (?, ?)',
+                     (cache_key, sqlite3.Binary(output)))
+
+
+def run_script(code, out):
+    """Execute the script, streaming its output to ``out``."""
+    if not os.path.exists('/dev/cache'):
+        snakebin.execute_code(code, out=out)
+        return
+
+    # The router asked us to cache the output. It's only saved once the
+    # script has finished without an error, so the output of a run which
+    # failed or was cut short is never sent again.
+    cache = CacheBuffer(snakebin.EXECUTE_CACHE_MAX_SIZE)
+    saved = False
+    try:
+        truncated = snakebin.execute_code(code, out=TeeWriter(out, cache))
+        if not (truncated or cache.full) and \
+                snakebin.execute_cache.accepts(cache.size):
+            save_output(cache.getvalue())
+            saved = True
+    finally:
+        if not saved:
+            # `/dev/cache-new` replaces the whole cache, so write it back
+            # unchanged.
+            with open('/dev/cache') as fp, open('/dev/cache-new', 'a') as new:
+                shutil.copyfileobj(fp, new)
+
+
+if __name__ == '__main__':
+    http_accept = os.environ.get('HTTP_ACCEPT', '')
+    execute = os.environ.get('SNAKEBIN_EXECUTE', None)
+    if 'text/html' in http_accept:
+        # Something that looks like a browser is requesting the document:
+        content_type = 'text/html; charset=utf-8'
+    else:
+        # Some other type of client is requesting the document:
+        content_type = 'text/plain'
+
+    if execute is not None:
+        # Load the code first, so that a script which doesn't compile fails
+        # before we start sending a response.
+        code = load_code()
+        out = snakebin.http_resp_writer(200, 'OK', content_type=content_type)
+        run_script(code, out)
+        out.close()
+    else:
+        # The script itself never changes, so the client can cache it.
+        headers = snakebin.cache_headers(os.environ.get('SNAKEBIN_ETAG'))
+        if 'text/html' in http_accept:
+            page_template.send(read_contents(), extra_headers=headers)
+        else:
+            # Plain text: send the script straight from `/dev/input`,
+            # without reading it into memory.
+            with open('/dev/input') as fp:
+                snakebin.http_resp(200, 'OK', content_type=content_type,
+                                   msg=fp, extra_headers=headers)
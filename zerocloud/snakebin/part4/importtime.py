@@ -0,0 +1,87 @@
+"""Import-time profiler for Snakebin.
+
+Python 2.7 has no ``-X importtime``, so this does the same thing by wrapping
+the built-in ``__import__``. Run a script through it to find out which
+imports its start-up time goes on::
+
+    $ python importtime.py snakebin.py
+
+The script runs as usual. When it exits, a report of the modules it imported
+is written to stderr, with the time taken by each one, both including
+(``cumulative``) and excluding (``self``) the modules it imported in turn.
+"""
+import __builtin__
+import atexit
+import os
+import runpy
+import sys
+import time
+
+# Number of modules to list in the report (the slowest ones):
+REPORT_LIMIT = int(os.environ.get('SNAKEBIN_IMPORT_REPORT_LIMIT', 30))
+
+
+class ImportProfiler(object):
+
+    def __init__(self):
+        self.started = time.time()
+        # module name -> [cumulative seconds, self seconds, depth]
+        self.modules = {}
+        self.order = []
+        self._stack = []
+        self._import = None
+
+    def install(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._timed_import
+
+    def uninstall(self):
+        __builtin__.__import__ = self._import
+
+    def _timed_import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            # Already imported (the usual case), so don't bother timing it.
+            return self._import(name, *args, **kwargs)
+        self._stack.append(0.0)
+        start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.modules:
+                self.order.append(name)
+                self.modules[name] = [elapsed, elapsed - nested,
+                                      len(self._stack)]
+
+    def report(self, fp=None, limit=REPORT_LIMIT):
+        fp = fp or sys.stderr
+        total = time.time() - self.started
+        imports = sum(cumulative for cumulative, _self, depth
+                      in self.modules.values() if depth == 0)
+        fp.write('import time: %.1f ms of %.1f ms in total, %d modules\n'
+                 % (imports * 1000, total * 1000, len(self.modules)))
+        fp.write('%10s %10s  %s\n' % ('self ms', 'cumul. ms', 'module'))
+        slowest = sorted(self.order, key=lambda name: -self.modules[name][1])
+        for name in slowest[:limit]:
+            cumulative, self_time, depth = self.modules[name]
+            fp.write('%10.2f %10.2f  %s%s\n' % (
+                self_time * 1000, cumulative * 1000, '  ' * depth, name))
+        fp.flush()
+
+
+def main(argv):
+    if not argv:
+        sys.exit('usage: importtime.py SCRIPT [ARGS]')
+    profiler = ImportProfiler()
+    profiler.install()
+    atexit.register(profiler.report)
+    sys.argv = argv
+    sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+    runpy.run_path(argv[0], run_name='__main__')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
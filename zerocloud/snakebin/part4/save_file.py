@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import sys
+import tarfile
+
+import search_index
+import snakebin
+
+# Copy the script to the store in blocks of this size:
+CHUNK_SIZE = 64 * 1024
+
+
+def save_inline(scripts):
+    """Add small scripts to the inline store. ``scripts`` is a dict of short
+    name -> contents.
+
+    The store is read from `/dev/inline`, and the updated copy written to
+    `/dev/inline-new`, which is mapped to the same object.
+    """
+    with snakebin.update_database('/dev/inline', '/dev/inline-new') as conn:
+        snakebin.inline_store.create_table(conn)
+        conn.executemany('INSERT OR REPLACE INTO script VALUES (?, ?)',
+                         [(short_name, sqlite3.Binary(contents))
+                          for short_name, contents in scripts.items()])
+
+
+def save_index(scripts):
+    """Add scripts to the search index. ``scripts`` is a dict of short name
+    -> set of trigrams in the script.
+
+    The trigrams of each script go to its own delta, on the
+    `/dev/delta-<short name>` device. The shards of the index are left alone,
+    so that save jobs running at the same time can't lose each other's
+    changes.
+    """
+    for short_name, trigrams in scripts.items():
+        with open('/dev/%s' % search_index.delta_device(short_name),
+                  'a') as fp:
+            search_index.write_delta(fp, trigrams)
+
+
+def store_script(post_contents, output='/dev/output', keep=False):
+    """Copy the contents of the file-like object ``post_contents`` to the
+    ``output`` device, and collect its trigrams for the search index.
+
+    Returns the set of trigrams, and the contents (with ``keep``; otherwise
+    ``None``).
+    """
+    trigrams = search_index.TrigramCollector()
+    # Only small scripts (for the inline store) are kept in memory.
+    chunks = []
+    with open(output, 'a') as fp:
+        while True:
+            chunk = post_contents.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            fp.write(chunk)
+            trigrams.update(chunk)
+            if keep:
+                chunks.append(chunk)
+
+    return trigrams.trigrams, ''.join(chunks) if keep else None
+
+
+def save_file(post_contents, public_file_path, inline=False):
+    """Copy the contents of the file-like object ``post_contents`` to the
+    store, and add it to the search index. With ``inline``, the script is
+    also added to the inline store.
+    """
+    _rest, container, short_name = public_file_path.rsplit('/', 2)
+    trigrams, contents = store_script(post_contents, keep=inline)
+    save_index({short_name: trigrams})
+    if inline:
+        save_inline({short_name: contents})
+
+    file_url = 'http://%(host)s/api/%(acct)s/%(cont)s/%(short_name)s\n'
+    file_url %= dict(host=os.environ.get('HTTP_HOST'), cont=container,
+                     acct=os.environ.get('PATH_INFO').strip('/'),
+                     short_name=short_name)
+
+    snakebin.http_resp(201, 'Created', msg=file_url)
+
+
+def save_files(archive):
+    """Save the scripts of a bulk upload, from the tar file ``archive``.
+
+    The archive starts with a manifest from the router, which lists the URLs
+    to respond with, and the scripts to add to the inline store. Each script
+    is in the archive under its short name, and goes to the ``output-``
+    device for that name. All of them are added to the search index at once.
+    """
+    manifest = None
+    inline_scripts = {}
+    indexed = {}
+    tar = tarfile.open(fileobj=archive, mode='r|')
+    for member in tar:
+        fp = tar.extractfile(member)
+        if member.name == snakebin.BULK_MANIFEST:
+            manifest = json.load(fp)
+            continue
+        short_name = member.name
+        inline = short_name in manifest['inline']
+        trigrams, contents = store_script(
+            fp, output='/dev/output-%s' % short_name, keep=inline)
+        indexed[short_name] = trigrams
+        if inline:
+            inline_scripts[short_name] = contents
+
+    save_index(indexed)
+    if inline_scripts:
+        save_inline(inline_scripts)
+
+    snakebin.http_resp(201, 'Created', content_type='application/json',
+                       msg=json.dumps(manifest['urls']))
+
+
+if __name__ == '__main__':
+    if os.environ.get('SNAKEBIN_BULK') is not None:
+        save_files(sys.stdin)
+    else:
+        public_file_path = os.environ.get('SNAKEBIN_PUBLIC_FILE_PATH')
+
+        inline = os.environ.get('SNAKEBIN_INLINE') is not None
+
+        save_file(sys.stdin, public_file_path, inline=inline)
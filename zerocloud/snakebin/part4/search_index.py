@@ -0,0 +1,197 @@
+"""Trigram index for Snakebin search.
+
+The index maps each three-byte sequence (trigram) to the names of the scripts
+which contain it: the "posting list" of the trigram. A script can only contain
+a search term if it contains every trigram of the term, so intersecting the
+posting lists of the trigrams of a term gives the scripts which can match,
+without reading any of the scripts, or the postings of any other trigrams.
+
+The index is split into ``SHARDS`` sqlite databases by the first byte of the
+trigram, so a search only reads the shards which the trigrams of the query are
+in. Each shard has one row per trigram, with its posting list.
+
+Swift objects can't be changed in place, and the trigrams of a script are
+spread over most of the shards, so if saves changed the shards, every save
+would rewrite most of the index, and saves running at the same time would
+overwrite each other's changes. Instead, each save writes a "delta" of its
+own, and leaves the shards alone. A delta is an object in the
+``snakebin-index-delta`` container, named after the script, with the sorted
+trigrams of the script. Searches check the deltas as well as the shards, and
+``compact_index.py`` merges the deltas into the shards from time to time.
+"""
+import sqlite3
+
+TRIGRAM_SIZE = 3
+# Number of shards the index is split into. The index has to be built again
+# if this is changed.
+SHARDS = 16
+INDEX_CONTAINER = 'snakebin-index'
+SHARD_NAME = 'shard-%02d.db'
+DELTA_CONTAINER = 'snakebin-index-delta'
+# Separates (and ends) the names in a posting list.
+NAME_SEPARATOR = '\n'
+
+
+def query_trigrams(term):
+    """Return the set of trigrams in the search ``term``."""
+    return set(term[i:i + TRIGRAM_SIZE]
+               for i in range(len(term) - TRIGRAM_SIZE + 1))
+
+
+def shard_of(trigram):
+    """Return the number of the shard which ``trigram`` is in."""
+    return ord(trigram[0]) % SHARDS
+
+
+def shard_path(shard):
+    return 'swift://~/%s/%s' % (INDEX_CONTAINER, SHARD_NAME % shard)
+
+
+def shard_device(shard):
+    """Name of the device a job reads ``shard`` from."""
+    return 'index-%02d' % shard
+
+
+def delta_path(name):
+    return 'swift://~/%s/%s' % (DELTA_CONTAINER, name)
+
+
+def delta_device(name):
+    """Name of the device a job reads or writes the delta of the script
+    ``name`` on.
+    """
+    return 'delta-%s' % name
+
+
+def write_delta(fp, trigrams):
+    """Write a delta with the set of ``trigrams`` of a script to ``fp``.
+
+    The trigrams are written one after the other, in order, so that a single
+    trigram can be found with a binary search, without reading them all into
+    a set.
+    """
+    fp.write(''.join(sorted(trigrams)))
+
+
+def read_delta(data):
+    """Return the set of trigrams in the delta ``data``."""
+    return set(data[i:i + TRIGRAM_SIZE]
+               for i in range(0, len(data), TRIGRAM_SIZE))
+
+
+def delta_contains(data, trigram):
+    """Check if the delta ``data`` contains ``trigram``."""
+    low, high = 0, len(data) // TRIGRAM_SIZE
+    while low < high:
+        middle = (low + high) // 2
+        start = middle * TRIGRAM_SIZE
+        found = data[start:start + TRIGRAM_SIZE]
+        if found < trigram:
+            low = middle + 1
+        elif found > trigram:
+            high = middle
+        else:
+            return True
+    return False
+
+
+class TrigramCollector(object):
+    """Collect the trigrams of a file which is fed to it in chunks."""
+
+    def __init__(self):
+        self.trigrams = set()
+        # The last bytes of the previous chunk, which can start a trigram
+        # which ends in the next chunk.
+        self._tail = ''
+
+    def update(self, chunk):
+        data = self._tail + chunk
+        self.trigrams.update(query_trigrams(data))
+        self._tail = data[-(TRIGRAM_SIZE - 1):]
+
+
+def _split_names(names):
+    return str(names).split(NAME_SEPARATOR)[:-1]
+
+
+def add_postings(conn, postings):
+    """Add names to the posting lists in the shard database ``conn``.
+    ``postings`` is a dict of trigram -> set of names to add.
+
+    Names which are in a posting list already aren't added again, so merging
+    the same delta twice does no harm.
+    """
+    conn.execute('CREATE TABLE IF NOT EXISTS posting '
+                 '(trigram BLOB PRIMARY KEY, names TEXT)')
+    for trigram, names in postings.items():
+        key = sqlite3.Binary(trigram)
+        row = conn.execute('SELECT names FROM posting WHERE trigram=?',
+                           (key, )).fetchone()
+        old_names = '' if row is None else str(row[0])
+        new_names = sorted(set(names) - set(_split_names(old_names)))
+        if new_names:
+            conn.execute('INSERT OR REPLACE INTO posting VALUES (?, ?)',
+                         (key, old_names + ''.join(
+                             name + NAME_SEPARATOR for name in new_names)))
+
+
+class IndexReader(object):
+    """Read-only view of the index shards and the deltas of the scripts
+    called ``delta_names``, mapped to the devices of a job.
+
+    Each shard is opened the first time one of its trigrams is looked up, and
+    each delta is read the first time it is needed.
+    """
+
+    def __init__(self, delta_names=(), device_dir='/dev'):
+        self.delta_names = delta_names
+        self.device_dir = device_dir
+        self._conns = {}
+        self._deltas = {}
+
+    def _conn(self, shard):
+        if shard not in self._conns:
+            conn = sqlite3.connect('%s/%s' % (self.device_dir,
+                                              shard_device(shard)))
+            conn.execute('PRAGMA query_only = 1')
+            self._conns[shard] = conn
+        return self._conns[shard]
+
+    def postings(self, trigram):
+        """Return the set of names of the scripts which contain
+        ``trigram``.
+        """
+        sql = 'SELECT names FROM posting WHERE trigram=?'
+        try:
+            row = self._conn(shard_of(trigram)).execute(
+                sql, (sqlite3.Binary(trigram), )).fetchone()
+        except sqlite3.OperationalError:
+            # Nothing has been saved to this shard yet.
+            return set()
+        if row is None:
+            return set()
+        return set(_split_names(row[0]))
+
+    def _delta(self, name):
+        if name not in self._deltas:
+            with open('%s/%s' % (self.device_dir, delta_device(name))) as fp:
+                self._deltas[name] = fp.read()
+        return self._deltas[name]
+
+    def candidates(self, trigrams):
+        """Return the set of names of the scripts which contain all of
+        ``trigrams``.
+        """
+        names = None
+        for trigram in trigrams:
+            postings = self.postings(trigram)
+            names = postings if names is None else names & postings
+            if not names:
+                # No need to look at the other trigrams.
+                break
+        names = names or set()
+        for name in self.delta_names:
+            delta = self._delta(name)
+            if all(delta_contains(delta, trigram) for trigram in trigrams):
+                names.add(name)
+        return names
@@ -0,0 +1,19 @@
+import json
+import os
+
+import search_query
+
+query = search_query.SearchQuery.from_env()
+
+with open('/dev/input') as fp:
+    matches = query.find_matches(search_query.map_file(fp))
+
+if matches:
+    document_name = os.environ.get('LOCAL_PATH_INFO').split('/')[-1]
+    doc_url = 'http://%(host)s/api/%(acct)s/%(cont)s/%(short_name)s'
+    doc_url %= dict(host=os.environ.get('HTTP_HOST'), cont='snakebin-api',
+                   acct=os.environ.get('PATH_INFO').strip('/'),
+                   short_name=document_name)
+
+    with open('/dev/out/search-reducer', 'a') as fp:
+        fp.write(json.dumps({'url': doc_url, 'matches': matches}) + '\n')
@@ -0,0 +1,37 @@
+import json
+import os
+
+import search_index
+import search_query
+import snakebin
+
+query = search_query.SearchQuery.from_env()
+
+# The router maps the index shards which the trigrams of the query are in,
+# and the deltas which haven't been merged into the shards yet.
+index = search_index.IndexReader(
+    os.environ.get('SNAKEBIN_INDEX_DELTAS', '').split())
+names = set()
+for trigrams in query.trigram_sets():
+    names.update(index.candidates(trigrams))
+
+if names:
+    limit = os.environ.get('SNAKEBIN_SEARCH_LIMIT')
+    if limit is not None:
+        limit = int(limit)
+    offset = int(os.environ.get('SNAKEBIN_SEARCH_OFFSET', 0))
+    if len(names) > snakebin.MAX_SEARCH_CANDIDATES:
+        # A group for each of these scripts would make the job too large, so
+        # search all of the scripts, with a single wildcard group.
+        graph = snakebin.search_job(query, limit=limit, offset=offset)
+    else:
+        # Start a search job for just the scripts which can match.
+        graph = snakebin.search_job(query, sorted(names), limit=limit,
+                                    offset=offset)
+    snakebin.http_resp(200, 'OK', content_type='application/json',
+                       msg=graph.to_json(),
+                       extra_headers={'X-Zerovm-Execute': '1.0'})
+else:
+    # Nothing can match, so there's no need to search anything.
+    snakebin.http_resp(200, 'OK', content_type='application/json',
+                       msg=json.dumps([]))
@@ -0,0 +1,213 @@
+"""Search queries for Snakebin.
+
+A query consists of one or more terms, which are either plain strings or
+regular expressions. A document matches if it contains all of the terms (the
+default) or, for ``op=or`` queries, any of them.
+
+The query is passed from the router to each of the jobs involved in a search
+through environment variables.
+"""
+import heapq
+import json
+import mmap
+import os
+import re
+
+import search_index
+
+# Maximum number of matches to report per document:
+MAX_MATCHES = 10
+# Maximum length of a snippet of matching text:
+MAX_SNIPPET = 200
+
+
+def _is_true(value):
+    return value is not None and value.lower() in ('1', 'true', 'yes', 'on')
+
+
+class InvalidQuery(ValueError):
+    """Raised for a query which can't be run, like one with an invalid
+    regular expression.
+    """
+
+
+def map_file(fp):
+    """Map the file ``fp`` into memory, read-only.
+
+    Regular expressions can search the mapped file directly, so the contents
+    never have to be copied into a Python string. If the file can't be mapped
+    (for example, because it's empty), it is read instead.
+    """
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        fp.seek(0)
+        return fp.read()
+
+
+class SearchQuery(object):
+
+    def __init__(self, terms, match_all=True, regex=False, ignore_case=False):
+        self.terms = terms
+        self.match_all = match_all
+        self.regex = regex
+        self.ignore_case = ignore_case
+        self._patterns = None
+
+    @classmethod
+    def from_params(cls, params):
+        """Build a query from the request parameters ``q`` (can be given more
+        than once), ``op`` (``and`` or ``or``), ``regex`` and ``icase``.
+        """
+        terms = params.get('q') or []
+        if not isinstance(terms, list):
+            terms = [terms]
+        return cls([term for term in terms if term],
+                   match_all=params.get('op', 'and').lower() != 'or',
+                   regex=_is_true(params.get('regex')),
+                   ignore_case=_is_true(params.get('icase')))
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        terms = [term.encode('utf-8')
+                 for term in json.loads(environ['SNAKEBIN_SEARCH'])]
+        return cls(terms,
+                   match_all=environ.get('SNAKEBIN_SEARCH_OP') != 'or',
+                   regex=_is_true(environ.get('SNAKEBIN_SEARCH_REGEX')),
+                   ignore_case=_is_true(environ.get('SNAKEBIN_SEARCH_ICASE')))
+
+    def set_envvars(self, job):
+        """Pass this query on to the given ``Job``."""
+        job.set_envvar('SNAKEBIN_SEARCH', json.dumps(self.terms))
+        job.set_envvar('SNAKEBIN_SEARCH_OP', 'and' if self.match_all else 'or')
+        job.set_envvar('SNAKEBIN_SEARCH_REGEX', str(self.regex))
+        job.set_envvar('SNAKEBIN_SEARCH_ICASE', str(self.ignore_case))
+
+    def trigram_sets(self):
+        """Return a list of sets of trigrams, for looking up in the search
+        index. A document can only match the query if it contains all of the
+        trigrams in at least one of the sets.
+
+        Returns ``None`` if the index can't be used for this query.
+        """
+        if self.regex or self.ignore_case or not self.terms:
+            return None
+        sets = [search_index.query_trigrams(term) for term in self.terms]
+        if self.match_all:
+            sets = [set.union(*sets)]
+        if not all(sets):
+            # A term is too short to have any trigrams.
+            return None
+        return sets
+
+    def _compile(self, pattern):
+        flags = re.MULTILINE
+        if self.ignore_case:
+            flags |= re.IGNORECASE
+        try:
+            return re.compile(pattern, flags)
+        except re.error as exc:
+            raise InvalidQuery('Invalid regular expression %r: %s'
+                               % (pattern, exc))
+
+    def check(self):
+        """Raise ``InvalidQuery`` if the query can't be run."""
+        if self.regex:
+            self.patterns
+
+    @property
+    def patterns(self):
+        """The compiled regular expressions which find the terms.
+
+        Plain terms are all found by a single regular expression, in one
+        pass over the text. Each term is wrapped in a named group (``t0``,
+        ``t1``, ...), so we can tell which one matched, and the whole thing is
+        wrapped in a lookahead, so that terms which overlap are all found.
+
+        Regular expressions are searched for one at a time, each with a
+        pattern of its own. In a single pattern, only one of them would be
+        found where two of them match at the same offset, and wrapping them in
+        groups would change the numbers of their own groups (which ``\\1``
+        and so on refer to).
+        """
+        if self._patterns is None:
+            if self.regex:
+                self._patterns = [self._compile(term) for term in self.terms]
+            else:
+                patterns = [re.escape(term) for term in self.terms]
+                # Try longer terms first, so a term isn't hidden by another
+                # term which is a prefix of it. (The reverse is handled by
+                # `_implied`.)
+                order = sorted(range(len(patterns)),
+                               key=lambda i: -len(patterns[i]))
+                pattern = '(?=%s)' % '|'.join(
+                    '(?P<t%d>%s)' % (i, patterns[i]) for i in order
+                )
+                self._patterns = [self._compile(pattern)]
+        return self._patterns
+
+    def _iter_matches(self, buf):
+        # Yield `(start, end, term index)` for each match in `buf`, in order
+        # of `start`.
+        if not self.regex:
+            for match in self.patterns[0].finditer(buf):
+                start, end = match.span(match.lastgroup)
+                yield start, end, int(match.lastgroup[1:])
+            return
+        # Merge the matches of each term, which are found lazily, so that we
+        # can still stop early.
+        for item in heapq.merge(*[_term_matches(pattern, buf, i)
+                                  for i, pattern in enumerate(self.patterns)]):
+            yield item
+
+    def _implied(self):
+        # For each term, the other terms which are found whenever it is found
+        # (because they are a part of it).
+        if self.regex:
+            return [set() for _ in self.terms]
+        terms = self.terms
+        if self.ignore_case:
+            terms = [term.lower() for term in terms]
+        return [set(j for j, other in enumerate(terms)
+                    if j != i and other in term)
+                for i, term in enumerate(terms)]
+
+    def find_matches(self, buf, max_matches=MAX_MATCHES):
+        """Search ``buf`` (a string or a memory-mapped file) for the terms.
+
+        Returns a list of up to ``max_matches`` matches, as dicts with the
+        ``term``, the ``offset`` of the match and a ``snippet`` (the line the
+        match is on), or ``None`` if the document does not match the query.
+        """
+        if not self.terms:
+            return None
+        implied = self._implied()
+        found = set()
+        matches = []
+        for start, end, index in self._iter_matches(buf):
+            found.add(index)
+            found.update(implied[index])
+            if len(matches) < max_matches:
+                line_start = buf.rfind('\n', 0, start) + 1
+                line_end = buf.find('\n', end)
+                if line_end == -1:
+                    line_end = len(buf)
+                line_end = min(line_end, line_start + MAX_SNIPPET)
+                snippet = buf[line_start:line_end]
+                matches.append({
+                    'term': self.terms[index],
+                    'offset': start,
+                    'snippet': snippet.decode('utf-8', 'replace'),
+                })
+            done = len(found) == len(self.terms) or not self.match_all
+            if done and len(matches) >= max_matches:
+                break
+
+        if self.match_all and len(found) < len(self.terms):
+            return None
+        return matches or None
+
+
+def _term_matches(pattern, buf, index):
+    for match in pattern.finditer(buf):
+        yield match.start(), match.end(), index
@@ -0,0 +1,45 @@
+import itertools
+import os
+
+import snakebin
+
+inp_dir = '/dev/in'
+
+
+def read_results(inp_dir):
+    """Yield each search result sent by the mappers.
+
+    Files are read one at a time, in a stable order, so that the same page
+    is returned for the same ``offset``.
+    """
+    for inp_file in sorted(os.listdir(inp_dir)):
+        with open(os.path.join(inp_dir, inp_file)) as fp:
+            for line in fp:
+                if line.strip():
+                    yield line.strip()
+
+
+def json_array(items):
+    """Yield the pieces of a JSON array of ``items``, which are already
+    JSON-encoded.
+    """
+    yield '['
+    for i, item in enumerate(items):
+        if i > 0:
+            yield ', '
+        yield item
+    yield ']'
+
+
+if __name__ == '__main__':
+    limit = os.environ.get('SNAKEBIN_SEARCH_LIMIT')
+    if limit is not None:
+        limit = int(limit)
+    offset = int(os.environ.get('SNAKEBIN_SEARCH_OFFSET', 0))
+
+    # Stop reading as soon as we have the requested page of results.
+    stop = None if limit is None else offset + limit
+    results = itertools.islice(read_results(inp_dir), offset, stop)
+
+    snakebin.http_resp(200, 'OK', content_type='application/json',
+                       msg=json_array(results))
@@ -0,0 +1,1341 @@
+import contextlib
+import hashlib
+import imp
+import json
+import os
+import random
+import re
+import stat
+import string
+import StringIO
+import sys
+import tempfile
+import time
+import urlparse
+
+import dispatch
+import timing
+
+# Modules which are only needed for some requests (like `sqlite3`, `tarfile`
+# and `search_query`) are imported where they are used, so that other requests
+# don't have to wait for them to be imported. Falcon is only imported by the
+# router itself, at the end, and only if it is used to dispatch the request:
+# the other scripts of the app only import this module for its helpers.
+
+
+# Size of the chunks used when streaming a response from a file:
+CHUNK_SIZE = 64 * 1024
+# Size of the blocks used when copying a file of known size to the response:
+FILE_BLOCK_SIZE = 1024 * 1024
+# Maximum number of bytes of output to send back from an executed script.
+# Anything after that is cut off.
+MAX_OUTPUT = int(os.environ.get('SNAKEBIN_MAX_OUTPUT', 16 * 1024 * 1024))
+TRUNCATED_MESSAGE = '\n[Output truncated after %d bytes]\n'
+# Dependencies precompiled with `build_deps.py`:
+DEPS_ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'deps.zip')
+# Maximum size of a script which can be uploaded or executed. Larger request
+# bodies are rejected with 413, before they are read into memory.
+MAX_UPLOAD = int(os.environ.get('SNAKEBIN_MAX_UPLOAD', 1024 * 1024))
+# Limits for bulk uploads: the size of the whole archive, and the number of new
+# scripts in it (each of which needs two devices in the save job).
+MAX_BULK_UPLOAD = int(
+    os.environ.get('SNAKEBIN_MAX_BULK_UPLOAD', 64 * 1024 * 1024)
+)
+MAX_BULK_SCRIPTS = int(os.environ.get('SNAKEBIN_MAX_BULK_SCRIPTS', 100))
+# Name of the list of URLs and inline scripts in the archive for the bulk save
+# job. Short names never have a '.' in them, so it can't clash with a script.
+BULK_MANIFEST = 'manifest.json'
+# How the router dispatches the request to a handler: with Falcon ('falcon'),
+# or with the one-shot dispatcher in `dispatch.py` ('oneshot'), which skips
+# setting up a WSGI app for a process that only ever handles one request.
+DISPATCH_MODE = os.environ.get('SNAKEBIN_DISPATCH', 'falcon')
+
+
+def _header_text(extra_headers):
+    if extra_headers is None:
+        return ''
+    return ''.join(
+        ['%s: %s\r\n' % (k, v) for k, v in extra_headers.items()]
+    )
+
+
+def http_resp(code, reason, content_type='message/http', msg='',
+              extra_headers=None):
+    """Write an HTTP response to stdout.
+
+    ``msg`` can also be a file object or an iterable of strings. Regular files
+    are copied to stdout in large blocks, without reading them into memory
+    first. Anything else is sent with chunked transfer encoding, as the data
+    is read or produced.
+    """
+    if hasattr(msg, 'read'):
+        msg_len = _remaining_size(msg)
+        if msg_len is not None:
+            _http_resp_file(code, reason, content_type, msg, msg_len,
+                            extra_headers)
+            return
+    if not isinstance(msg, basestring):
+        _http_resp_chunked(code, reason, content_type, msg, extra_headers)
+        return
+
+    http_resp_head(code, reason, content_type, len(msg), extra_headers)
+    sys.stdout.write(msg)
+
+
+def http_resp_head(code, reason, content_type, msg_len, extra_headers=None):
+    """Write the head of an HTTP response with a body of ``msg_len`` bytes to
+    stdout. The caller then writes the body itself.
+    """
+    head = """\
+HTTP/1.1 %(code)s %(reason)s\r
+%(extra_headers)sContent-Type: %(content_type)s\r
+Content-Length: %(msg_len)s\r
+\r
+"""
+    head %= dict(code=code, reason=reason, content_type=content_type,
+                 msg_len=msg_len, extra_headers=_header_text(extra_headers))
+    sys.stdout.write(head)
+
+
+def _remaining_size(fp):
+    # The number of bytes left to read from `fp`, if it's a regular file.
+    try:
+        st = os.fstat(fp.fileno())
+    except (AttributeError, EnvironmentError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_size - fp.tell()
+
+
+def _http_resp_file(code, reason, content_type, fp, msg_len, extra_headers):
+    http_resp_head(code, reason, content_type, msg_len, extra_headers)
+    remaining = msg_len
+    while remaining > 0:
+        block = fp.read(min(FILE_BLOCK_SIZE, remaining))
+        if not block:
+            raise IOError('%d bytes missing from the end of the file'
+                          % remaining)
+        sys.stdout.write(block)
+        remaining -= len(block)
+
+
+def _http_resp_chunked(code, reason, content_type, msg, extra_headers):
+    if hasattr(msg, 'read'):
+        fp = msg
+        msg = iter(lambda: fp.read(CHUNK_SIZE), '')
+    writer = http_resp_writer(code, reason, content_type=content_type,
+                              extra_headers=extra_headers)
+    # The writer collects the strings into chunks of ``CHUNK_SIZE`` bytes, and
+    # sends whatever is left when it is closed.
+    for chunk in msg:
+        writer.write(chunk)
+    writer.close()
+
+
+def http_resp_writer(code, reason, content_type='message/http',
+                     extra_headers=None):
+    """Write the head of an HTTP response with chunked transfer encoding to
+    stdout, and return a ``ChunkedWriter`` for writing the body.
+    """
+    head = """\
+HTTP/1.1 %(code)s %(reason)s\r
+%(extra_headers)sContent-Type: %(content_type)s\r
+Transfer-Encoding: chunked\r
+\r
+"""
+    head %= dict(code=code, reason=reason, content_type=content_type,
+                 extra_headers=_header_text(extra_headers))
+    sys.stdout.write(head)
+    return ChunkedWriter(sys.stdout)
+
+
+class ChunkedWriter(object):
+    """File-like object which sends everything written to it to ``fp``, with
+    chunked transfer encoding.
+
+    Small writes (like the ones made by ``print``) are collected until there
+    are ``chunk_size`` bytes, or until the writer is flushed, so the client
+    doesn't receive a chunk for every line.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self._buf = []
+        self._buf_len = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self._buf.append(data)
+        self._buf_len += len(data)
+        if self._buf_len >= self.chunk_size:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._buf_len:
+            self.fp.write('%x\r\n' % self._buf_len)
+            self.fp.write(''.join(self._buf))
+            self.fp.write('\r\n')
+            self._buf = []
+            self._buf_len = 0
+        self.fp.flush()
+
+    def close(self):
+        """Send any remaining data, and the end of the response."""
+        self.flush()
+        self.fp.write('0\r\n\r\n')
+        self.fp.flush()
+
+
+# Names of groups and devices end up in file names (like `/dev/in/<group>`),
+# so they are limited to a safe set of characters.
+VALID_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+# Devices which every Snakebin job needs.
+DEFAULT_DEVICES = (
+    {'name': 'python2.7'},
+    {'name': 'stdout', 'content_type': 'message/http'},
+    {'name': 'image', 'path': 'swift://~/snakebin-app/snakebin.zapp'},
+)
+
+
+class JobError(ValueError):
+    """Raised for a job description which ZeroCloud would reject."""
+
+
+def _check_name(kind, name):
+    if not VALID_NAME.match(name):
+        raise JobError('Invalid %s name: %r' % (kind, name))
+
+
+class Job(object):
+    """A group of a ZeroCloud job: one program, and the devices it uses.
+
+    With a ``count``, ZeroCloud starts that many instances of the group,
+    named ``<name>-1`` to ``<name>-<count>``.
+    """
+
+    def __init__(self, name, args, count=None, devices=DEFAULT_DEVICES):
+        _check_name('group', name)
+        if count is not None and count < 1:
+            raise JobError('Invalid count for %s: %r' % (name, count))
+        self.name = name
+        self.args = args
+        self.count = count
+        self.devices = [dict(dev) for dev in devices]
+        self.env = {}
+        self.connect = []
+        self._json = None
+
+    def add_device(self, name, content_type=None, path=None):
+        _check_name('device', name)
+        if any(dev['name'] == name for dev in self.devices):
+            raise JobError('Duplicate device %r in %s' % (name, self.name))
+        dev = {'name': name}
+        if content_type is not None:
+            dev['content_type'] = content_type
+        if path is not None:
+            dev['path'] = path
+        self.devices.append(dev)
+        self._json = None
+
+    def set_envvar(self, key, value):
+        self.env[key] = value
+        self._json = None
+
+    def connect_to(self, name):
+        """Connect the output of this group to the input of the group called
+        ``name``.
+        """
+        if name not in self.connect:
+            self.connect.append(name)
+            self._json = None
+
+    def node_json(self):
+        """The JSON for this group, in the job description. This is only
+        serialized again after the job changes.
+        """
+        if self._json is None:
+            self._json = json.dumps(self.to_dict())
+        return self._json
+
+    def to_json(self):
+        return JobGraph([self]).to_json()
+
+    def to_tar(self, files, out=None):
+        """Pack the job description into a tar archive, together with the
+        data in ``files`` (a dict of device name -> contents, either as a
+        string or as a file, which is read from its current position).
+
+        ZeroCloud attaches each file in the archive to the device with the
+        same name, so this lets us hand data to a job without encoding it into
+        the job description itself.
+
+        The archive is written to the file ``out``, if given. Otherwise, it is
+        returned as a string.
+        """
+        import tarfile
+        buf = StringIO.StringIO() if out is None else out
+        tar = tarfile.open(fileobj=buf, mode='w')
+        members = [('boot/system.map', self.to_json())] + files.items()
+        for name, data in members:
+            add_tar_member(tar, name, data)
+        tar.close()
+        if out is None:
+            return buf.getvalue()
+
+    def to_dict(self):
+        node = {
+            'name': self.name,
+            'exec': {
+                'path': 'file://python2.7:python',
+                'args': self.args,
+                'env': self.env,
+            },
+            'devices': self.devices,
+        }
+        if self.count is not None:
+            node['count'] = self.count
+        if self.connect:
+            node['connect'] = self.connect
+        return node
+
+
+def add_tar_member(tar, name, data):
+    """Add ``data`` (a string, or a file which is read from its current
+    position) to the open tar file ``tar``, as ``name``.
+    """
+    import tarfile
+    if isinstance(data, basestring):
+        data = StringIO.StringIO(data)
+    start = data.tell()
+    data.seek(0, 2)
+    info = tarfile.TarInfo(name)
+    info.size = data.tell() - start
+    data.seek(start)
+    tar.addfile(info, data)
+
+
+class JobGraph(object):
+    """A ZeroCloud job made up of one or more groups (``Job`` objects), and
+    the connections between them.
+    """
+
+    def __init__(self, jobs=()):
+        self.jobs = []
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        if any(other.name == job.name for other in self.jobs):
+            raise JobError('Duplicate group %r' % job.name)
+        self.jobs.append(job)
+        return job
+
+    def connect(self, source, dest):
+        """Connect each of the ``source`` groups (a ``Job`` or a list of
+        them) to the ``dest`` group.
+        """
+        if isinstance(source, Job):
+            source = [source]
+        for job in source:
+            job.connect_to(dest.name)
+
+    def validate(self):
+        names = set(job.name for job in self.jobs)
+        for job in self.jobs:
+            for name in job.connect:
+                if name not in names:
+                    raise JobError('%s is connected to unknown group %r'
+                                   % (job.name, name))
+
+    def to_json(self):
+        self.validate()
+        return '[%s]' % ', '.join(job.node_json() for job in self.jobs)
+
+
+class ContainerIndex(object):
+    """Read-only view of a container database.
+
+    ZeroCloud maps the listing of the container to `/dev/input` as a sqlite
+    database. The database is opened once, the first time it is needed, and
+    the same connection is used for all lookups after that. Since the
+    statements are always the same, sqlite3's statement cache means they only
+    get prepared once as well.
+    """
+
+    # Maximum number of names to look up in a single query. sqlite limits the
+    # number of parameters a statement can have.
+    BATCH_SIZE = 500
+
+    def __init__(self, path='/dev/input'):
+        self.path = path
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+            self._conn = sqlite3.connect(self.path)
+            # This is a snapshot of the container; nothing should write to it.
+            self._conn.execute('PRAGMA query_only = 1')
+        return self._conn
+
+    def object_info(self, name):
+        """Return a dict with the ``size`` and ``etag`` of the object with the
+        given ``name``, or ``None`` if there is no such object.
+        """
+        sql = 'SELECT size, etag FROM object WHERE name=? AND deleted=0'
+        row = self.conn.execute(sql, (name, )).fetchone()
+        if row is None:
+            return None
+        return {'size': row[0], 'etag': row[1]}
+
+    def exists(self, name):
+        return self.object_info(name) is not None
+
+    def names(self, limit=None):
+        """Return the names of the objects in the container, in order, or
+        the first ``limit`` of them.
+        """
+        sql = 'SELECT name FROM object WHERE deleted=0 ORDER BY name'
+        if limit is None:
+            rows = self.conn.execute(sql)
+        else:
+            rows = self.conn.execute(sql + ' LIMIT ?', (limit, ))
+        return [row[0] for row in rows]
+
+    def existing(self, names):
+        """Return the set of ``names`` for which there is an object in the
+        container.
+        """
+        names = list(names)
+        found = set()
+        for i in range(0, len(names), self.BATCH_SIZE):
+            batch = names[i:i + self.BATCH_SIZE]
+            sql = ('SELECT name FROM object WHERE deleted=0 AND name IN (%s)'
+                   % ','.join('?' * len(batch)))
+            found.update(row[0] for row in self.conn.execute(sql, batch))
+        return found
+
+
+container_index = ContainerIndex()
+
+# The output of executed scripts is cached in a sqlite database, which the
+# router can send it from itself, like the inline store below. This is
+# opt-in: the cache is only used if it is mapped to this device in
+# `zapp.yaml`.
+EXECUTE_CACHE_DEVICE = '/dev/cache'
+EXECUTE_CACHE_PATH = 'swift://~/snakebin-cache/cache.db'
+# Output of up to this many bytes is cached:
+EXECUTE_CACHE_MAX_SIZE = int(
+    os.environ.get('SNAKEBIN_EXECUTE_CACHE_MAX_SIZE', 16 * 1024)
+)
+# The router loads the whole cache for every request, so it is kept small:
+EXECUTE_CACHE_STORE_MAX_SIZE = int(
+    os.environ.get('SNAKEBIN_EXECUTE_CACHE_STORE_MAX_SIZE', 4 * 1024 * 1024)
+)
+
+# Scripts which were saved since the search index was last compacted (with
+# `compact_index.py`) each have a delta in the ``snakebin-index-delta``
+# container, which searches have to check as well as the shards of the index.
+# The index is only used if the container is mapped to this device in
+# `zapp.yaml`; otherwise, every search scans all of the scripts.
+INDEX_DELTA_DEVICE = '/dev/index-delta'
+index_deltas = ContainerIndex(INDEX_DELTA_DEVICE)
+# Each delta is a device of the search planner job, so if there are more than
+# this many, searches scan all of the scripts until the index is compacted.
+MAX_INDEX_DELTAS = int(os.environ.get('SNAKEBIN_MAX_INDEX_DELTAS', 100))
+# Each script which the index finds is searched by a group of its own. If
+# there are more than this many, all of the scripts are searched instead, so
+# the job doesn't get too large.
+MAX_SEARCH_CANDIDATES = int(
+    os.environ.get('SNAKEBIN_MAX_SEARCH_CANDIDATES', 1000)
+)
+
+# The compiled bytecode of executed scripts is kept in the
+# ``snakebin-bytecode`` container, away from the scripts themselves. This is
+# opt-in as well: bytecode is only used if the container is mapped to this
+# device in `zapp.yaml`.
+BYTECODE_DEVICE = '/dev/bytecode'
+bytecode_index = ContainerIndex(BYTECODE_DEVICE)
+
+
+# Small scripts are also kept in a sqlite database, which the router can
+# serve them from itself, without starting a `snakebin-get-file` job. This is
+# opt-in as well: the store is only used if it is mapped to this device in
+# `zapp.yaml`.
+INLINE_STORE_DEVICE = '/dev/inline'
+INLINE_STORE_PATH = 'swift://~/snakebin-inline/store.db'
+# Scripts of up to this many bytes go into the inline store:
+INLINE_MAX_SIZE = int(os.environ.get('SNAKEBIN_INLINE_MAX_SIZE', 4 * 1024))
+# The router loads the whole store for every request, so it is kept small:
+INLINE_STORE_MAX_SIZE = int(
+    os.environ.get('SNAKEBIN_INLINE_STORE_MAX_SIZE', 4 * 1024 * 1024)
+)
+
+
+class InlineStore(object):
+    """Read-only view of the inline store, or of another sqlite database
+    like it, whose ``table`` maps names to contents.
+
+    The store is written by another job (``save_file.py``, for the inline
+    store). It starts out as an empty object (which is an empty sqlite
+    database). Entries of up to ``max_size`` bytes are added to it, until it
+    grows to ``store_max_size`` bytes.
+    """
+
+    def __init__(self, path=INLINE_STORE_DEVICE, table='script',
+                 max_size=INLINE_MAX_SIZE,
+                 store_max_size=INLINE_STORE_MAX_SIZE):
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.store_max_size = store_max_size
+        self._conn = None
+
+    @property
+    def enabled(self):
+        return os.path.exists(self.path)
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            import sqlite3
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute('PRAGMA query_only = 1')
+        return self._conn
+
+    def accepts(self, size, added=0):
+        """Check if an entry of ``size`` bytes should be added to the store,
+        along with ``added`` bytes of other entries.
+        """
+        return (self.enabled and size <= self.max_size
+                and os.path.getsize(self.path) + added + size
+                <= self.store_max_size)
+
+    def get(self, name):
+        """Return the contents of the entry called ``name``, or ``None`` if
+        it isn't in the store.
+        """
+        if not self.enabled:
+            return None
+        import sqlite3
+        sql = 'SELECT contents FROM %s WHERE name=?' % self.table
+        try:
+            row = self.conn.execute(sql, (name, )).fetchone()
+        except sqlite3.OperationalError:
+            # Nothing has been saved to the store yet.
+            return None
+        if row is None:
+            return None
+        return str(row[0])
+
+    def create_table(self, conn):
+        """Create the table of the store, in the writable copy ``conn``."""
+        conn.execute('CREATE TABLE IF NOT EXISTS %s '
+                     '(name TEXT PRIMARY KEY, contents BLOB)' % self.table)
+
+
+inline_store = InlineStore()
+execute_cache = InlineStore(EXECUTE_CACHE_DEVICE, table='output',
+                            max_size=EXECUTE_CACHE_MAX_SIZE,
+                            store_max_size=EXECUTE_CACHE_STORE_MAX_SIZE)
+
+
+@contextlib.contextmanager
+def update_database(src, dest):
+    """Open a copy of the sqlite database on the device ``src``, to change it.
+
+    Swift objects can't be changed in place, so the database is copied to a
+    temporary file (sqlite needs a file it can write to), and when the
+    ``with`` block is done, the copy is written to the device ``dest``, which
+    is mapped to the same object.
+    """
+    import shutil
+    import sqlite3
+    fd, path = tempfile.mkstemp(suffix='.db')
+    try:
+        with os.fdopen(fd, 'w') as db_fp, open(src) as fp:
+            shutil.copyfileobj(fp, db_fp)
+        conn = sqlite3.connect(path)
+        with conn:
+            yield conn
+        conn.close()
+        with open(path) as db_fp, open(dest, 'a') as fp:
+            shutil.copyfileobj(db_fp, fp)
+    finally:
+        os.unlink(path)
+
+
+def execute_cache_key(etag):
+    """Key for the cached output of the script with the given ``etag``.
+
+    The output of a script also depends on the version of Python which runs
+    it, so that is part of the key as well.
+    """
+    return '%s-python%d.%d.%d' % ((etag, ) + tuple(sys.version_info[:3]))
+
+
+# Scripts never change, so clients can keep them for as long as they like.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def script_etag(etag, http_accept):
+    """Strong ETag for the response ``get_file.py`` sends for the script with
+    the given object ``etag``, to a client with the given ``Accept`` header.
+
+    Browsers get an HTML page instead of the script itself, so they need a
+    different tag. The page also depends on the template, so its tag
+    includes the version of the template, and changes when the template
+    does.
+    """
+    if 'text/html' in (http_accept or ''):
+        return '"%s-html-%s"' % (etag, index_page.version)
+    return '"%s-text"' % etag
+
+
+def etag_matches(if_none_match, etag):
+    """Check if the value of an ``If-None-Match`` header matches ``etag``."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def cache_headers(etag):
+    """Headers which let clients cache a script with the given ``etag``."""
+    if etag is None:
+        return None
+    return {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL,
+        'Vary': 'Accept',
+    }
+
+
+def _object_exists(name):
+    """Check the local container (mapped to `/dev/input`) to see if it contains
+    an object with the given ``name``.
+    """
+    with request_timer.span('lookup'):
+        return container_index.exists(name)
+
+
+def random_short_name(seed, length=10):
+    rand = random.Random()
+    rand.seed(seed)
+    name = ''.join(rand.sample(string.ascii_lowercase
+                               + string.ascii_uppercase
+                               + string.digits, length))
+    return name
+
+
+def _handle_script(req, resp, account, container, script, execute=False):
+    if '.' in script:
+        # Script names never contain a '.', so there's nothing to look up.
+        resp.status = dispatch.HTTP_404
+        return
+    # Go get the requested script, or 404 if it doesn't exist.
+    with request_timer.span('lookup'):
+        info = container_index.object_info(script)
+    if info is not None:
+        if not execute:
+            etag = script_etag(info['etag'], os.environ.get('HTTP_ACCEPT'))
+            if etag_matches(req.get_header('If-None-Match'), etag):
+                # The client already has the script, and it can't have
+                # changed, so there's no need to send it again.
+                resp.status = dispatch.HTTP_304
+                resp.set_headers(cache_headers(etag))
+                return
+            with request_timer.span('inline'):
+                contents = inline_store.get(script)
+            if contents is not None:
+                # A small script: send it from here, without starting
+                # another job.
+                _send_inline(resp, contents, etag)
+                return
+        else:
+            with request_timer.span('cache'):
+                output = execute_cache.get(execute_cache_key(info['etag']))
+            if output is not None:
+                # We've run this script before: send the output from last
+                # time, without starting another job.
+                _send_output(resp, output)
+                return
+
+        job = Job('snakebin-get-file', 'get_file.py')
+        job.set_envvar('HTTP_ACCEPT', os.environ.get('HTTP_ACCEPT'))
+        if not execute:
+            job.add_device('input',
+                           path='swift://~/snakebin-store/%s' % script)
+            job.set_envvar('SNAKEBIN_ETAG', etag)
+        else:
+            job.set_envvar('SNAKEBIN_EXECUTE', 'True')
+            _add_execute_devices(job, script, info['etag'])
+        # Setting this header and content_type will make ZeroCloud
+        # intercept the request and spawn a new job, instead of responding
+        # directly to the client.
+        resp.set_header('X-Zerovm-Execute', '1.0')
+        resp.content_type = 'application/json'
+        resp.status = dispatch.HTTP_200
+        with request_timer.span('manifest'):
+            resp.body = job.to_json()
+    else:
+        resp.status = dispatch.HTTP_404
+
+
+def _add_execute_devices(job, script, etag):
+    """Map the devices the ``snakebin-get-file`` job needs to execute
+    ``script``, whose ETag is ``etag``.
+    """
+    private_file_path = 'swift://~/snakebin-store/%s' % script
+    job.add_device('input', path=private_file_path)
+    # Have `get_file.py` save the output for next time, if there's room in
+    # the cache.
+    if execute_cache.accepts(0):
+        job.add_device('cache', path=EXECUTE_CACHE_PATH)
+        job.add_device('cache-new', path=EXECUTE_CACHE_PATH,
+                       content_type='application/octet-stream')
+        job.set_envvar('SNAKEBIN_CACHE_KEY', execute_cache_key(etag))
+
+    if not os.path.exists(BYTECODE_DEVICE):
+        return
+    # Use the compiled bytecode, if the script has been executed before.
+    # Otherwise, have `get_file.py` save it for next time.
+    bytecode_path = 'swift://~/snakebin-bytecode/%s' % bytecode_name(script)
+    with request_timer.span('lookup'):
+        saved = bytecode_index.object_info(bytecode_name(script))
+    # A job which failed may have left an empty object behind, so that
+    # doesn't count as saved bytecode.
+    if saved is not None and saved['size'] > 0:
+        job.add_device('bytecode', path=bytecode_path)
+        job.set_envvar('SNAKEBIN_BYTECODE', 'load')
+    else:
+        job.add_device('bytecode', path=bytecode_path,
+                       content_type='application/octet-stream')
+        job.set_envvar('SNAKEBIN_BYTECODE', 'save')
+
+
+def _send_inline(resp, contents, etag):
+    """Respond with the script ``contents``, the same way ``get_file.py``
+    would.
+    """
+    resp.set_headers(cache_headers(etag))
+    if 'text/html' in os.environ.get('HTTP_ACCEPT', ''):
+        parts, length = index_page.render(contents)
+        resp.content_type = PageTemplate.CONTENT_TYPE
+        resp.set_stream(parts, length)
+    else:
+        resp.content_type = 'text/plain'
+        resp.data = contents
+    resp.status = dispatch.HTTP_200
+
+
+def _send_output(resp, output):
+    """Respond with the cached ``output`` of a script, the same way
+    ``get_file.py`` sends the output of a script which it runs.
+    """
+    if 'text/html' in os.environ.get('HTTP_ACCEPT', ''):
+        resp.content_type = 'text/html; charset=utf-8'
+    else:
+        resp.content_type = 'text/plain'
+    resp.data = output
+    resp.status = dispatch.HTTP_200
+
+
+class UploadTooLarge(Exception):
+    """Raised for a request body larger than the upload limit."""
+
+
+def read_upload(stream, content_length=None, max_size=MAX_UPLOAD):
+    """Read an upload (like a request body) from the file ``stream`` in
+    chunks, into a spooled temporary file, hashing it on the way.
+
+    Returns the file (positioned at the start), the size of the upload and its
+    ``sha1`` hash. Raises ``UploadTooLarge`` if the upload is larger than
+    ``max_size``: straight away if its ``content_length`` says so, or else as
+    soon as too much has been read.
+    """
+    if content_length is not None and content_length > max_size:
+        raise UploadTooLarge()
+    # Small scripts stay in memory, large ones are spooled to disk.
+    fp = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    file_hash = hashlib.sha1()
+    size = 0
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            fp.close()
+            raise UploadTooLarge()
+        file_hash.update(chunk)
+        fp.write(chunk)
+    fp.seek(0)
+    return fp, size, file_hash
+
+
+def _upload_too_large(resp, message='Scripts can be at most %d bytes.'
+                      % MAX_UPLOAD):
+    resp.status = dispatch.HTTP_413
+    resp.content_type = 'text/plain'
+    resp.body = message + '\n'
+
+
+def script_url(account, container, short_name):
+    """The URL to give to the client for the script ``short_name``."""
+    path = '/api/%s/%s/%s' % (account, container, short_name)
+    return urlparse.urlunparse((
+        'http',
+        os.environ.get('HTTP_HOST'),
+        path,
+        None,
+        None,
+        None
+    ))
+
+
+def _add_delta_device(job, short_name):
+    """Map the search index delta of the script ``short_name`` to ``job``,
+    for writing.
+    """
+    import search_index
+    job.add_device(search_index.delta_device(short_name),
+                   path=search_index.delta_path(short_name),
+                   content_type='application/octet-stream')
+
+
+def _handle_script_upload(req, resp, account, container, script=None):
+    try:
+        upload, size, file_hash = read_upload(req.stream, req.content_length)
+    except UploadTooLarge:
+        _upload_too_large(resp)
+        return
+    short_name = random_short_name(file_hash.hexdigest())
+
+    snakebin_file_path = 'swift://~/snakebin-store/%s' % short_name
+    public_file_path = 'swift://~/snakebin-api/%s' % short_name
+
+    if _object_exists(short_name):
+        # This means the file already exists. No problem!
+        # Since the short url is derived from the hash of the contents,
+        # just return a URL to the file.
+        resp.status = dispatch.HTTP_200
+        resp.body = script_url(account, container, short_name) + '\n'
+    else:
+        # Go and save the file.
+        # We need to spawn another ZeroVM job to write this file.
+        job = Job('snakebin-save-file', 'save_file.py')
+        job.set_envvar('SNAKEBIN_PUBLIC_FILE_PATH', public_file_path)
+        job.add_device('stdin')
+        job.add_device('output', path=snakebin_file_path,
+                       content_type='text/plain')
+        # The save job adds the script to the search index, with a delta of
+        # its own.
+        _add_delta_device(job, short_name)
+        if inline_store.accepts(size):
+            # Have `save_file.py` add the script to the inline store, too.
+            job.set_envvar('SNAKEBIN_INLINE', 'True')
+            job.add_device('inline', path=INLINE_STORE_PATH)
+            job.add_device('inline-new', path=INLINE_STORE_PATH,
+                           content_type='application/octet-stream')
+        # Setting this header and content_type will make ZeroCloud
+        # intercept the request and spawn a new job, instead of responding
+        # directly to the client. The file contents go along with the job
+        # description in a tar archive, and will show up on the `stdin` of
+        # the new job.
+        resp.set_header('X-Zerovm-Execute', '1.0')
+        resp.content_type = 'application/x-tar'
+        resp.status = dispatch.HTTP_200
+        archive = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+        with request_timer.span('manifest'):
+            job.to_tar({'stdin': upload}, out=archive)
+        resp.set_stream(archive, archive.tell())
+        archive.seek(0)
+
+
+def _handle_bulk_upload(req, resp, account, container):
+    """Save all of the scripts in a tar archive, with a single save job, and
+    respond with a JSON list of their URLs.
+    """
+    import tarfile
+    try:
+        upload, _size, _hash = read_upload(req.stream, req.content_length,
+                                           max_size=MAX_BULK_UPLOAD)
+    except UploadTooLarge:
+        _upload_too_large(resp, 'Bulk uploads can be at most %d bytes.'
+                          % MAX_BULK_UPLOAD)
+        return
+
+    # Each script is read into a file of its own, and hashed on the way,
+    # just like a single upload.
+    scripts = []
+    try:
+        tar = tarfile.open(fileobj=upload, mode='r|')
+        for member in tar:
+            if not member.isfile():
+                continue
+            fp, size, file_hash = read_upload(tar.extractfile(member),
+                                              member.size)
+            short_name = random_short_name(file_hash.hexdigest())
+            scripts.append((member.name, short_name, fp, size))
+    except tarfile.TarError:
+        resp.status = dispatch.HTTP_400
+        resp.content_type = 'text/plain'
+        resp.body = 'Bulk uploads must be tar archives.\n'
+        return
+    except UploadTooLarge:
+        _upload_too_large(resp)
+        return
+
+    # Check which scripts are saved already, all at once.
+    with request_timer.span('lookup'):
+        existing = container_index.existing(
+            short_name for _file, short_name, _fp, _size in scripts)
+    new_scripts = []
+    seen = set(existing)
+    for _file, short_name, fp, size in scripts:
+        if short_name not in seen:
+            seen.add(short_name)
+            new_scripts.append((short_name, fp, size))
+    if len(new_scripts) > MAX_BULK_SCRIPTS:
+        _upload_too_large(resp, 'Bulk uploads can have at most %d new scripts.'
+                          % MAX_BULK_SCRIPTS)
+        return
+
+    urls = [{'file': file_name,
+             'url': script_url(account, container, short_name)}
+            for file_name, short_name, _fp, _size in scripts]
+    if not new_scripts:
+        resp.status = dispatch.HTTP_200
+        resp.content_type = 'application/json'
+        resp.body = json.dumps(urls)
+        return
+
+    # One save job writes all of the new scripts, each to its own pair of
+    # devices: one for the script, and one for its search index delta.
+    job = Job('snakebin-save-files', 'save_file.py')
+    job.set_envvar('SNAKEBIN_BULK', 'True')
+    job.add_device('stdin')
+    inline = []
+    inline_size = 0
+    for short_name, fp, size in new_scripts:
+        job.add_device('output-%s' % short_name,
+                       path='swift://~/snakebin-store/%s' % short_name,
+                       content_type='text/plain')
+        _add_delta_device(job, short_name)
+        if inline_store.accepts(size, added=inline_size):
+            inline.append(short_name)
+            inline_size += size
+    if inline:
+        job.add_device('inline', path=INLINE_STORE_PATH)
+        job.add_device('inline-new', path=INLINE_STORE_PATH,
+                       content_type='application/octet-stream')
+
+    # The save job gets the new scripts on `stdin`, as a tar archive of their
+    # own, after a manifest with the response and the inline scripts.
+    scripts_tar = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    tar = tarfile.open(fileobj=scripts_tar, mode='w')
+    add_tar_member(tar, BULK_MANIFEST,
+                   json.dumps({'urls': urls, 'inline': inline}))
+    for short_name, fp, _size in new_scripts:
+        add_tar_member(tar, short_name, fp)
+    tar.close()
+    scripts_tar.seek(0)
+
+    resp.set_header('X-Zerovm-Execute', '1.0')
+    resp.content_type = 'application/x-tar'
+    resp.status = dispatch.HTTP_200
+    archive = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    with request_timer.span('manifest'):
+        job.to_tar({'stdin': scripts_tar}, out=archive)
+    resp.set_stream(archive, archive.tell())
+    archive.seek(0)
+
+
+def bytecode_name(script):
+    """Name of the object holding the compiled bytecode for ``script``.
+
+    Bytecode can only be loaded by the same version of Python which wrote it,
+    so the name includes the "magic number" which identifies that version.
+    """
+    return '%s.%s.pyc' % (script, imp.get_magic().encode('hex'))
+
+
+def compile_code(code):
+    """Compile the source ``code`` to a code object, which can be marshalled
+    and passed to ``execute_code`` later on.
+    """
+    return compile(code, '<snakebin>', 'exec')
+
+
+class OutputLimitExceeded(BaseException):
+    """Raised in an executed script when it has written too much output.
+
+    Like ``SystemExit``, it isn't an ``Exception``, so that a script can't
+    keep going by catching it with ``except Exception``.
+    """
+
+
+class LimitedWriter(object):
+    """File-like object which passes on up to ``limit`` bytes to ``fp``.
+
+    Writing any more raises ``OutputLimitExceeded``, which stops the script.
+    """
+
+    def __init__(self, fp, limit):
+        self.fp = fp
+        self.limit = limit
+        self.written = 0
+        self.truncated = False
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        room = self.limit - self.written
+        if len(data) > room:
+            self.fp.write(data[:room])
+            self.written = self.limit
+            self.truncated = True
+            raise OutputLimitExceeded(self.limit)
+        self.fp.write(data)
+        self.written += len(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.fp.flush()
+
+
+def execute_code(code, out=None, max_output=MAX_OUTPUT):
+    """Execute ``code`` (either source code or a code object).
+
+    The output is written to the file-like object ``out`` as it is produced.
+    If ``out`` is not given, the output is collected and returned instead. At
+    most ``max_output`` bytes are written; if the script prints any more, it
+    is stopped and a note saying that the output was truncated is added.
+
+    When ``out`` is given, returns ``True`` if the output was truncated.
+    """
+    if out is None:
+        out = StringIO.StringIO()
+        execute_code(code, out=out, max_output=max_output)
+        return out.getvalue()
+
+    # Patch stdout, so the output from the submitted code goes to `out`
+    old_stdout = sys.stdout
+    limited_stdout = LimitedWriter(out, max_output)
+    sys.stdout = limited_stdout
+
+    # Create a module with the code
+    module = imp.new_module('dontcare')
+    module.__name__ = "__main__"
+
+    # Execute the submitted code
+    try:
+        exec code in module.__dict__
+    except OutputLimitExceeded:
+        pass
+    finally:
+        # Unpatch stdout
+        sys.stdout = old_stdout
+
+    if limited_stdout.truncated:
+        out.write(TRUNCATED_MESSAGE % max_output)
+    return limited_stdout.truncated
+
+
+class PageTemplate(object):
+    """The HTML page shown to browsers, with the contents of a script in it.
+
+    The template file is split at the ``{code}`` placeholder the first time
+    it's needed. After that, a page is sent by writing the part before the
+    placeholder, the escaped script and the part after it, one after the
+    other, without ever joining them into one string.
+    """
+
+    PLACEHOLDER = '{code}'
+    CONTENT_TYPE = 'text/html; charset=utf-8'
+
+    def __init__(self, path):
+        self.path = path
+        self._parts = None
+        self._blank_page = None
+        self._version = None
+
+    @property
+    def parts(self):
+        """The ``(prefix, suffix)`` around the placeholder."""
+        if self._parts is None:
+            with open(self.path) as fp:
+                prefix, suffix = fp.read().split(self.PLACEHOLDER, 1)
+            self._parts = prefix, suffix
+        return self._parts
+
+    @property
+    def version(self):
+        """A short hash of the template, for the ETags of pages."""
+        if self._version is None:
+            self._version = hashlib.sha1(
+                self.PLACEHOLDER.join(self.parts)).hexdigest()[:12]
+        return self._version
+
+    @property
+    def blank_page(self):
+        """The page without a script, and the headers to send with it."""
+        if self._blank_page is None:
+            body = ''.join(self.parts)
+            headers = {
+                'Content-Type': self.CONTENT_TYPE,
+                'Content-Length': str(len(body)),
+            }
+            self._blank_page = body, headers
+        return self._blank_page
+
+    def render(self, code):
+        """Return the parts of the page for the script ``code``, and their
+        total length.
+        """
+        from xml.sax.saxutils import escape
+        prefix, suffix = self.parts
+        parts = [prefix, escape(code), suffix]
+        return parts, sum(len(part) for part in parts)
+
+    def send(self, code, extra_headers=None):
+        """Write a response with the page for the script ``code`` to
+        stdout.
+        """
+        parts, length = self.render(code)
+        http_resp_head(200, 'OK', self.CONTENT_TYPE, length,
+                       extra_headers=extra_headers)
+        for part in parts:
+            sys.stdout.write(part)
+
+
+index_page = PageTemplate('index.html')
+
+# Only one request is handled per process, so one timer will do.
+request_timer = timing.RequestTimer()
+
+
+class TimingMiddleware(object):
+    """Time the setup of the app and the routing of the request, note which
+    route it took, and add the spans to the response if the client asked for
+    them with an ``X-Snakebin-Timing`` header.
+    """
+
+    def __init__(self, timer, routes):
+        self.timer = timer
+        # Map each resource to the URI template it was added with.
+        self.routes = dict((resource, template)
+                           for template, resource in routes)
+        self.requested = None
+        self.responded = None
+
+    def process_request(self, req, resp):
+        self.requested = time.time()
+        self.timer.add('setup', self.requested - self.timer.started)
+
+    def process_resource(self, req, resp, resource, params):
+        self.timer.add('routing', time.time() - self.requested)
+        template = self.routes.get(resource, '')
+        if params.get('script') in ('search', 'execute', 'bulk'):
+            template = template.replace('{script}', params['script'])
+        self.timer.route = '%s %s' % (req.method, template)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        self.timer.status = resp.status
+        if self.timer.route is None:
+            self.timer.route = '%s (no route)' % req.method
+        if req.get_header(timing.TIMING_HEADER):
+            resp.set_header(timing.TIMING_HEADER, self.timer.header_value())
+        self.responded = time.time()
+
+
+class RootHandler(object):
+
+    def on_get(self, req, resp, account, container):
+        """Serve a blank index.html page."""
+        resp.data, headers = index_page.blank_page
+        resp.set_headers(headers)
+        resp.status = dispatch.HTTP_200
+
+    def on_post(self, req, resp, account, container):
+        """Handle the form post/script upload."""
+        _handle_script_upload(req, resp, account, container)
+
+
+def search_job(query, names=None, limit=None, offset=0):
+    """Build a MapReduce ``JobGraph`` which searches scripts in
+    ``snakebin-store`` for ``query`` (a ``SearchQuery``).
+
+    By default, all scripts are searched. If a list of ``names`` is given,
+    only those scripts are searched. ``limit`` and ``offset`` select the page
+    of results to return.
+    """
+    if names is None:
+        inputs = [('search-mapper', 'swift://~/snakebin-store/*')]
+    else:
+        inputs = [('search-mapper-%s' % name,
+                   'swift://~/snakebin-store/%s' % name)
+                  for name in names]
+
+    graph = JobGraph()
+    reducer_job = Job('search-reducer', 'search_reducer.py')
+    if limit is not None:
+        reducer_job.set_envvar('SNAKEBIN_SEARCH_LIMIT', str(limit))
+    reducer_job.set_envvar('SNAKEBIN_SEARCH_OFFSET', str(offset))
+
+    for group_name, path in inputs:
+        mapper_job = graph.add(Job(group_name, 'search_mapper.py'))
+        mapper_job.add_device('input', path=path)
+        query.set_envvars(mapper_job)
+        mapper_job.set_envvar('HTTP_ACCEPT',
+                              os.environ.get('HTTP_ACCEPT', ''))
+        graph.connect(mapper_job, reducer_job)
+
+    graph.add(reducer_job)
+    return graph
+
+
+def _handle_search(req, resp, account, container):
+    import search_index
+    import search_query
+    params = dict(req.params)
+    if 'q' in params:
+        if isinstance(params['q'], list):
+            params['q'] = [urlparse.unquote(q) for q in params['q']]
+        else:
+            params['q'] = urlparse.unquote(params['q'])
+    query = search_query.SearchQuery.from_params(params)
+    try:
+        query.check()
+    except search_query.InvalidQuery as exc:
+        resp.status = dispatch.HTTP_400
+        resp.content_type = 'text/plain'
+        resp.body = '%s\n' % exc
+        return
+    limit = req.get_param_as_int('limit', min=0)
+    offset = req.get_param_as_int('offset', min=0) or 0
+    trigram_sets = query.trigram_sets()
+    deltas = None
+    if trigram_sets is not None and os.path.exists(INDEX_DELTA_DEVICE):
+        with request_timer.span('lookup'):
+            deltas = index_deltas.names(limit=MAX_INDEX_DELTAS + 1)
+    if deltas is not None and len(deltas) <= MAX_INDEX_DELTAS:
+        # Find the scripts which could contain the query using the index,
+        # and only search those. `search_planner.py` looks up the trigrams of
+        # the query in the shards of the index they are in, and in the deltas
+        # which haven't been merged into the shards yet, and starts the
+        # search job once it knows which scripts to search.
+        planner_job = Job('search-planner', 'search_planner.py')
+        shards = set(search_index.shard_of(trigram)
+                     for trigram in set.union(*trigram_sets))
+        for shard in sorted(shards):
+            planner_job.add_device(search_index.shard_device(shard),
+                                   path=search_index.shard_path(shard))
+        for name in deltas:
+            planner_job.add_device(search_index.delta_device(name),
+                                   path=search_index.delta_path(name))
+        planner_job.set_envvar('SNAKEBIN_INDEX_DELTAS', ' '.join(deltas))
+        query.set_envvars(planner_job)
+        if limit is not None:
+            planner_job.set_envvar('SNAKEBIN_SEARCH_LIMIT', str(limit))
+        planner_job.set_envvar('SNAKEBIN_SEARCH_OFFSET', str(offset))
+        planner_job.set_envvar('HTTP_ACCEPT',
+                               os.environ.get('HTTP_ACCEPT', ''))
+        graph = JobGraph([planner_job])
+    else:
+        # The index can't be used for this query (for example, because a
+        # term is too short, or it's a regular expression), or there are too
+        # many deltas to check, so search everything.
+        graph = search_job(query, limit=limit, offset=offset)
+    with request_timer.span('manifest'):
+        resp.body = graph.to_json()
+    resp.set_header('X-Zerovm-Execute', '1.0')
+    resp.content_type = 'application/json'
+    resp.status = dispatch.HTTP_200
+    sys.stderr.write('submitting search job')
+
+
+class ScriptHandler(object):
+
+    def on_get(self, req, resp, account, container, script):
+        if script == 'search':
+            _handle_search(req, resp, account, container)
+        else:
+            _handle_script(req, resp, account, container, script)
+
+    def on_post(self, req, resp, account, container, script):
+        if script == 'execute':
+            try:
+                upload, _size, _hash = read_upload(req.stream,
+                                                  req.content_length)
+            except UploadTooLarge:
+                _upload_too_large(resp)
+                return
+            file_data = upload.read()
+            # Small outputs stay in memory, large ones are spooled to disk.
+            output = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+            with request_timer.span('execute'):
+                execute_code(file_data, out=output)
+            resp.content_type = 'text/plain'
+            resp.status = dispatch.HTTP_200
+            resp.set_stream(output, output.tell())
+            output.seek(0)
+        elif script == 'bulk':
+            _handle_bulk_upload(req, resp, account, container)
+        else:
+            # Also allow new/modified scripts to be uploaded when the client is
+            # on a page like `/snakebin-api/Wg4re8mXbV`.
+            _handle_script_upload(req, resp, account, container, script=script)
+
+
+class ScriptExecuteHandler(object):
+
+    def on_get(self, req, resp, account, container, script):
+        _handle_script(req, resp, account, container, script, execute=True)
+
+
+if __name__ == '__main__':
+    request_timer.start()
+    routes = [
+        ('/{account}/{container}', RootHandler()),
+        # Handles `POST /{account}/{container}/execute` as well
+        ('/{account}/{container}/{script}', ScriptHandler()),
+        ('/{account}/{container}/{script}/execute', ScriptExecuteHandler()),
+    ]
+    timing_middleware = TimingMiddleware(request_timer, routes)
+    if DISPATCH_MODE == 'oneshot':
+        dispatch.run(dispatch.Router(routes), [timing_middleware])
+    else:
+        if os.path.exists(DEPS_ARCHIVE):
+            sys.path.insert(0, DEPS_ARCHIVE)
+        import falcon
+        import wsgiref.handlers
+        app = falcon.API(middleware=[timing_middleware])
+        for template, resource in routes:
+            app.add_route(template, resource)
+
+        handler = wsgiref.handlers.SimpleHandler(
+            sys.stdin,
+            sys.stdout,
+            sys.stderr,
+            environ=dict(os.environ),
+            multithread=False,
+        )
+        handler.run(app)
+    if timing_middleware.responded is not None:
+        request_timer.add('respond', time.time() - timing_middleware.responded)
+    request_timer.log()
@@ -0,0 +1,164 @@
+"""Timing spans for Snakebin requests.
+
+The time the router spends on a request is split into named stages, or
+"spans": routing the request to a handler, looking the script up, building
+the job description, running a script, and writing the response. If the
+zapp has a ``stderr`` device, a record of the spans is written to it at the
+end of each request, on a line of its own::
+
+    snakebin-timing {"route": "GET /{account}/{container}/{script}", ...}
+
+Run this module on any number of logs to get the latency of each stage of
+each route::
+
+    $ python timing.py snakebin-*.log
+"""
+import contextlib
+import json
+import math
+import os
+import sys
+import time
+
+TIMING_LOG_DEVICE = '/dev/stderr'
+# Marks the timing records in the log, which can have other output in it.
+RECORD_PREFIX = 'snakebin-timing '
+# Request header which asks for the spans in the response, and response
+# header which has them.
+TIMING_HEADER = 'X-Snakebin-Timing'
+PERCENTILES = (50, 95, 99)
+
+
+class RequestTimer(object):
+    """Collect the spans of a request, in milliseconds."""
+
+    def __init__(self):
+        self.started = None
+        self.route = None
+        self.status = None
+        self.spans = []
+
+    def start(self):
+        self.started = time.time()
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds * 1000.0))
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the body of a ``with`` block as the span ``name``."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def totals(self):
+        """Return a list of ``(name, milliseconds)`` pairs, in the order the
+        spans started, with repeated spans added together, and the time since
+        the start of the request as ``total``.
+        """
+        totals = {}
+        names = []
+        for name, millis in self.spans:
+            if name not in totals:
+                names.append(name)
+                totals[name] = 0.0
+            totals[name] += millis
+        result = [(name, totals[name]) for name in names]
+        if self.started is not None:
+            result.append(('total', (time.time() - self.started) * 1000.0))
+        return result
+
+    def header_value(self):
+        """Format the spans so far like a ``Server-Timing`` header."""
+        return ', '.join('%s;dur=%.2f' % (name, millis)
+                         for name, millis in self.totals())
+
+    def record(self):
+        return RECORD_PREFIX + json.dumps({
+            'route': self.route,
+            'status': self.status,
+            'started': self.started,
+            'spans': dict((name, round(millis, 3))
+                          for name, millis in self.totals()),
+        }, sort_keys=True)
+
+    def log(self, fp=None):
+        """Write the timing record to the log, if the zapp has one."""
+        if fp is None:
+            if not os.path.exists(TIMING_LOG_DEVICE):
+                return
+            fp = sys.stderr
+        fp.write('\n' + self.record() + '\n')
+        fp.flush()
+
+
+def read_records(lines):
+    """Yield the timing records found in ``lines`` of log output."""
+    for line in lines:
+        index = line.find(RECORD_PREFIX)
+        if index == -1:
+            continue
+        try:
+            yield json.loads(line[index + len(RECORD_PREFIX):])
+        except ValueError:
+            # Cut off, or mixed up with other output.
+            continue
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of the sorted list ``values``."""
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+
+def aggregate(records):
+    """Return ``{route: {span: sorted list of milliseconds}}``."""
+    routes = {}
+    for record in records:
+        spans = routes.setdefault(record.get('route'), {})
+        for name, millis in record['spans'].items():
+            spans.setdefault(name, []).append(millis)
+    for spans in routes.values():
+        for values in spans.values():
+            values.sort()
+    return routes
+
+
+def main(argv=None):
+    # Only needed here, so the router doesn't have to import it.
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Summarize the timing records in Snakebin logs')
+    parser.add_argument('logs', nargs='*',
+                        help='Log files to read (default: stdin)')
+    args = parser.parse_args(argv)
+
+    records = []
+    for path in args.logs or ['-']:
+        fp = sys.stdin if path == '-' else open(path)
+        with fp:
+            records.extend(read_records(fp))
+    if not records:
+        sys.exit('no timing records found')
+
+    print '%-45s %-10s %7s %s' % (
+        'route', 'span', 'count',
+        ' '.join('%9s' % ('p%d ms' % p) for p in PERCENTILES))
+    for route, spans in sorted(aggregate(records).items()):
+        # Slowest spans first, with the total at the end.
+        names = sorted((name for name in spans if name != 'total'),
+                       key=lambda name: -percentile(spans[name], 50))
+        if 'total' in spans:
+            names.append('total')
+        for name in names:
+            values = spans[name]
+            print '%-45s %-10s %7d %s' % (
+                route, name, len(values),
+                ' '.join('%9.2f' % percentile(values, p)
+                         for p in PERCENTILES))
+
+
+if __name__ == '__main__':
+    main()